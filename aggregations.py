@@ -0,0 +1,176 @@
+class Agg(object):
+    """
+    聚合 name 为聚合名称, params 为聚合参数
+    sub 添加子聚合: Terms('city', 'city').sub(Stats('age', 'age'))
+    """
+    agg_type = None
+
+    def __init__(self, name: str, **params):
+        if self.agg_type is None:
+            raise Exception('agg type is None')
+        self.name = name
+        self.params = {k: v for k, v in params.items() if v is not None}
+        self.aggs = list()
+
+    def sub(self, *aggs: "Agg") -> "Agg":
+        self.aggs.extend(aggs)
+        return self
+
+    def body(self) -> dict:
+        ret = {self.agg_type: self.params}
+        self.aggs and ret.update(aggs=Aggs(*self.aggs)()[Aggs.sen_name])
+        return ret
+
+    def __call__(self):
+        return {self.name: self.body()}
+
+
+class Terms(Agg):
+    """ 按字段值分组 """
+    agg_type = 'terms'
+
+    def __init__(self, name: str, field: str, size: int = 10, **params):
+        super().__init__(name, field=field, size=size, **params)
+
+
+class DateHistogram(Agg):
+    """ 按时间间隔分组 calendar_interval: 1d/1M 等; fixed_interval: 30m/12h 等 """
+    agg_type = 'date_histogram'
+
+    def __init__(self, name: str, field: str, calendar_interval: str = None, fixed_interval: str = None,
+                 format: str = None, **params):
+        if not (calendar_interval or fixed_interval):
+            raise Exception('DateHistogram need param(calendar_interval or fixed_interval)')
+        super().__init__(name, field=field, calendar_interval=calendar_interval, fixed_interval=fixed_interval,
+                         format=format, **params)
+
+
+class Metric(Agg):
+    """ 指标聚合 """
+
+    def __init__(self, name: str, field: str, **params):
+        super().__init__(name, field=field, **params)
+
+
+class Stats(Metric):
+    """ count/min/max/avg/sum """
+    agg_type = 'stats'
+
+
+class Cardinality(Metric):
+    """ 去重计数(近似值) """
+    agg_type = 'cardinality'
+
+    def __init__(self, name: str, field: str, precision_threshold: int = None, **params):
+        super().__init__(name, field, precision_threshold=precision_threshold, **params)
+
+
+class Sum(Metric):
+    agg_type = 'sum'
+
+
+class Avg(Metric):
+    agg_type = 'avg'
+
+
+class Min(Metric):
+    agg_type = 'min'
+
+
+class Max(Metric):
+    agg_type = 'max'
+
+
+class Nested(Agg):
+    """ 嵌套文档聚合 子聚合在 path 对应的嵌套文档上执行 """
+    agg_type = 'nested'
+
+    def __init__(self, name: str, path: str):
+        super().__init__(name, path=path)
+
+
+class Composite(Agg):
+    """
+    可翻页的多字段分组 sources 为 Terms/DateHistogram, 只使用其分组参数(忽略 size 与子聚合)
+    配合 SimpleESClient.composite 按 after_key 逐页遍历全部分组
+    """
+    agg_type = 'composite'
+
+    def __init__(self, name: str, sources: list, size: int = 1000, after: dict = None):
+        if not sources:
+            raise Exception('Composite need param(sources)')
+        super().__init__(name, size=size, after=after)
+        self.sources = list(sources)
+        self.params['sources'] = [
+            {s.name: {s.agg_type: {k: v for k, v in s.params.items() if k != 'size'}}} for s in self.sources
+        ]
+
+    def after(self, after_key: dict = None) -> "Composite":
+        """ 返回从 after_key 之后开始的新聚合 """
+        agg = type(self)(self.name, self.sources, size=self.params['size'], after=after_key)
+        agg.aggs = list(self.aggs)
+        return agg
+
+
+class Aggs(object):
+    """
+    聚合集合 传给 Q.__call__(aggs=...)
+    usage:
+    # >>> aggs = Aggs(Terms('city', 'city', size=20).sub(Stats('age', 'age')), Cardinality('users', 'user_id'))
+    # >>> body = Q.filter('term', sex=1)(aggs=aggs)
+    # >>> client.search(index='person', body=body).aggs()
+    """
+    sen_name = 'aggs'
+
+    def __init__(self, *aggs: Agg):
+        self.aggs = list(aggs)
+
+    def __call__(self):
+        ret = dict()
+        for agg in self.aggs:
+            ret.update(agg())
+        return {self.sen_name: ret}
+
+
+# 解析聚合结果时忽略的字段
+_META = ('meta', 'doc_count_error_upper_bound', 'sum_other_doc_count', 'after_key')
+
+
+def parse_bucket(bucket: dict) -> dict:
+    """ 分组: {'key': ..., 'doc_count': ..., 子聚合名: 子聚合结果} """
+    ret = dict()
+    if 'key' in bucket:
+        ret['key'] = bucket.get('key_as_string', bucket['key'])
+    ret['doc_count'] = bucket.get('doc_count', 0)
+    for key, value in bucket.items():
+        if isinstance(value, dict) and key not in ('key', 'meta'):
+            ret[key] = parse_agg(value)
+    return ret
+
+
+def parse_agg(node: dict):
+    """
+    把单个聚合的响应解析为紧凑结构
+    分组聚合 -> [bucket, ...] (keyed 时为 {key: bucket}); 单值聚合 -> 值;
+    nested/filter 等单分组聚合 -> bucket; stats 等多值聚合 -> dict
+    """
+    if 'buckets' in node:
+        buckets = node['buckets']
+        if isinstance(buckets, dict):
+            return {key: parse_bucket(b) for key, b in buckets.items()}
+        return [parse_bucket(b) for b in buckets]
+
+    if 'value' in node:
+        return node['value']
+
+    if 'doc_count' in node:
+        return parse_bucket(node)
+
+    if 'values' in node:
+        return node['values']
+
+    return {k: v for k, v in node.items() if k not in _META}
+
+
+def parse_aggs(aggregations: dict) -> dict:
+    return {name: parse_agg(node) for name, node in (aggregations or {}).items()}
@@ -0,0 +1,396 @@
+import asyncio
+import logging
+
+from typing import Dict
+from helper import hit_source
+from sentence import Result, Aggs, Composite, Update, Projection
+from cache import QueryCache, AsyncSingleFlight
+from serializer import install
+from metrics import Instrument, Span, NULL_SPAN
+from bulk import BulkReport
+from document import Document
+from tasks import AsyncESTask
+from simple_es_client import params_check
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.helpers import async_streaming_bulk
+
+
+class AsyncSimpleESClient(object):
+    """
+    SimpleESClient 的 asyncio 版本 基于 AsyncElasticsearch
+    max_concurrency: 同时在途的最大查询/写入请求数; 每次 bulk 调用自身串行流式提交, 不占用该配额
+    AsyncElasticsearch 的 maxsize(每个节点的 aiohttp 连接数, 默认 10)同样限制并发, 需不小于 max_concurrency/节点数
+    依赖 aiohttp: pip install es-orm[async]
+    single_flight: 合并并发的相同查询, 为空时不合并
+    serializer: 替换 es 连接的 json 序列化器, 如 serializer.FastJSONSerializer()
+    observers: 埋点观察者 callback(op, labels, metrics), 如 metrics.MetricsRecorder(); 为空时不埋点
+    usage:
+    # >>> client = AsyncSimpleESClient(AsyncElasticsearch([...], maxsize=200), max_concurrency=200)
+    # >>> result = await client.search(index='person', body=Q.filter('term', age=1)())
+    """
+
+    def __init__(self,
+                 es: AsyncElasticsearch,
+                 max_concurrency: int = 100,
+                 single_flight: AsyncSingleFlight = None,
+                 serializer: JSONSerializer = None,
+                 observers: list = None):
+        serializer is not None and install(es, serializer)
+        self.es: AsyncElasticsearch = es
+        self.max_concurrency = max_concurrency
+        self.single_flight: AsyncSingleFlight = single_flight
+        self.instrument: Instrument = observers and Instrument(observers) or None
+        self.instrument is not None and self.instrument.attach(es)
+        self._semaphore = None
+        self.stored_scripts = set()
+
+        # 连接在首次请求时才创建, 按传入 AsyncElasticsearch 的参数估算 aiohttp 连接数上限
+        hosts = getattr(es.transport, 'hosts', None) or [None]
+        limit = getattr(es.transport, 'kwargs', {}).get('maxsize', 10) * len(hosts)
+        if limit < max_concurrency:
+            logging.warning(f'AsyncSimpleESClient max_concurrency={max_concurrency} is capped by {limit} aiohttp '
+                            f'connections, pass maxsize to AsyncElasticsearch')
+
+    def _span(self, op: str, **labels) -> Span:
+        """ 埋点 未开启时返回空操作的 NULL_SPAN """
+        if self.instrument is None:
+            return NULL_SPAN
+        return self.instrument.span(op, labels)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 延迟创建 保证绑定到运行中的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        await self.es.close()
+
+    @params_check(required=['index', 'body'], request_timeout=999, lazy=False, projection=None, filter_path=None)
+    async def search(self, **kwargs):
+        """搜索 lazy=True 时遍历结果产出惰性的 Result.Row; projection/filter_path 同 SimpleESClient.search"""
+        if kwargs['projection'] is not None:
+            kwargs['body'] = {**kwargs['body'], **kwargs['projection']()}
+
+        params = {
+            'body': kwargs['body'],
+            'index': kwargs['index'],
+            'request_timeout': kwargs['request_timeout']
+        }
+
+        if kwargs.get('_source'):
+            params['_source'] = kwargs['_source']
+
+        if kwargs.get('doc_type'):
+            params['doc_type'] = kwargs['doc_type']
+
+        filter_path = Projection.filter_path(kwargs['filter_path'])
+        filter_path and params.update(filter_path=filter_path)
+
+        async def fetch():
+            async with self.semaphore:
+                return await self.es.search(**params)
+
+        with self._span('search', index=kwargs['index']) as span:
+            span.request()
+            if self.single_flight is not None:
+                key = QueryCache.make_key(kwargs['index'], kwargs['body'], [kwargs.get('_source'), filter_path])
+                return Result(span.response(await self.single_flight.do(key, fetch)), lazy=kwargs['lazy'])
+            return Result(span.response(await fetch()), lazy=kwargs['lazy'])
+
+    @params_check(required=['index', 'body'], refresh=False)
+    async def insert(self, **kwargs):
+        """插入数据 无ID可自动生成ID"""
+        params = {
+            'body': kwargs['body'],
+            'index': kwargs['index'],
+            'refresh': kwargs['refresh']
+        }
+
+        if kwargs.get('doc_type'):
+            params['doc_type'] = kwargs['doc_type']
+
+        if kwargs.get('id'):
+            params['id'] = kwargs['id']
+
+        async with self.semaphore:
+            await self.es.index(**params)
+
+    @params_check(refresh=False, required=['id', 'index', 'body'])
+    async def create(self, **kwargs):
+        """ 插入数据 必须手动加入ID """
+        params = {
+            'id': kwargs['id'],
+            'body': kwargs['body'],
+            'index': kwargs['index'],
+            'refresh': kwargs['refresh']
+        }
+
+        if kwargs.get('doc_type'):
+            params['doc_type'] = kwargs['doc_type']
+
+        async with self.semaphore:
+            await self.es.create(**params)
+
+    async def _run_bulk(self, actions, report: BulkReport, **kwargs) -> BulkReport:
+        """ async_streaming_bulk 流式提交 结果记录到 report; 请求异常(如超时)记为该批次全部失败, 不中断写入 """
+        with self._span('bulk') as span:
+            async for success, info in async_streaming_bulk(
+                    self.es, actions, raise_on_error=False, raise_on_exception=False, **kwargs):
+                report.add(success, info)
+
+            report.finish()
+            span.set(docs=report.total, failed=report.failed, docs_per_sec=report.docs_per_sec)
+        report.failed and logging.error(f'bulk error: {report.failed} failed, {report.dead_letters} dead letters')
+        return report
+
+    @params_check(required=['index', 'body'], refresh=False, limit=500, max_chunk_bytes=100 * 1024 * 1024,
+                  dead_letter=None, max_failed=1000)
+    async def bulk_insert(self, **kwargs):
+        """批量插入 body 可以是 list、生成器或异步生成器, 流式按 limit/max_chunk_bytes 提交
+        dead_letter: 失败数据写入的 jsonl 文件路径或回调
+        返回 BulkReport
+        """
+        report = BulkReport(kwargs['dead_letter'], kwargs['max_failed'])
+
+        def get_action(data):
+            try:
+                if isinstance(data, Document):
+                    return data.to_action(kwargs['index'])
+                return {**data, '_op_type': 'index', '_index': kwargs['index']}
+            except Exception as e:
+                report.add_invalid(data, e)
+
+        async def actions():
+            if hasattr(kwargs['body'], '__aiter__'):
+                async for d in kwargs['body']:
+                    action = d and get_action(d)
+                    if action:
+                        yield action
+            else:
+                for d in kwargs['body']:
+                    action = d and get_action(d)
+                    if action:
+                        yield action
+
+        return await self._run_bulk(
+            actions(),
+            report,
+            chunk_size=kwargs['limit'],
+            max_chunk_bytes=kwargs['max_chunk_bytes'],
+            refresh=kwargs['refresh'],
+        )
+
+    @params_check(required=['index', 'body'], scroll='5m', size=1000, slice_id=None, slice_max=None,
+                  projection=None, filter_path=True)
+    async def scroll(self, **kwargs):
+        """ scroll 逐页遍历 产出 Result; 遍历结束或中断时清理 scroll 上下文; projection/filter_path 同 search """
+        body = dict(kwargs['body'])
+        body.pop('from', None)
+        kwargs['projection'] is not None and body.update(kwargs['projection']())
+        if kwargs['slice_max'] and kwargs['slice_max'] > 1:
+            body['slice'] = {'id': kwargs['slice_id'], 'max': kwargs['slice_max']}
+
+        params = {'scroll': kwargs['scroll']}
+        filter_path = Projection.filter_path(kwargs['filter_path'])
+        filter_path and params.update(filter_path=filter_path)
+
+        async with self.semaphore:
+            data: Result = Result(await self.es.search(
+                index=kwargs['index'],
+                size=kwargs['size'],
+                body=body,
+                **params,
+            ))
+        scroll_id = data.scroll_id
+        try:
+            while data.hits():
+                yield data
+                async with self.semaphore:
+                    data = Result(await self.es.scroll(scroll_id=scroll_id, **params))
+                scroll_id = data.scroll_id or scroll_id
+        finally:
+            scroll_id and await self.es.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+    @params_check(required=['index', 'body'], scroll='5m', size=1000, slices=1, queue_size=None,
+                  projection=None, filter_path=True)
+    async def scan(self, **kwargs):
+        """ 遍历全部匹配数据 逐页产出 Result; slices>1 时各分片并发拉取, 页的顺序不保证 """
+        if kwargs['slices'] <= 1:
+            async for page in self.scroll(**kwargs):
+                yield page
+            return
+
+        slices = kwargs['slices']
+        pages = asyncio.Queue(maxsize=kwargs['queue_size'] or slices * 2)
+        done = object()
+
+        async def worker(slice_id):
+            try:
+                async for page in self.scroll(**{**kwargs, 'slice_id': slice_id, 'slice_max': slices}):
+                    await pages.put(page)
+            except Exception as e:
+                await pages.put(e)
+            finally:
+                await pages.put(done)
+
+        tasks = [asyncio.ensure_future(worker(i)) for i in range(slices)]
+        try:
+            finished = 0
+            while finished < slices:
+                page = await pages.get()
+                if page is done:
+                    finished += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            [t.cancel() for t in tasks if not t.done()]
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @params_check(required=['index', 'body', 'agg'], after=None, request_timeout=999)
+    async def composite_pages(self, **kwargs):
+        """ composite 聚合按 after_key 逐页查询 产出 Result, 参数同 SimpleESClient.composite_pages """
+        agg: Composite = kwargs['agg']
+        body = {**kwargs['body'], 'size': 0}
+        after = kwargs['after']
+        while True:
+            body.update(Aggs(agg.after(after))())
+            data = await self.search(index=kwargs['index'], body=body, request_timeout=kwargs['request_timeout'])
+            buckets = data.result.get('aggregations', {}).get(agg.name, {}).get('buckets', [])
+            if not buckets:
+                break
+
+            yield data
+            after = data.after_key(agg.name)
+            if after is None or len(buckets) < agg.params['size']:
+                break
+
+    async def composite(self, **kwargs):
+        """ 流式遍历 composite 聚合的全部分组 参数同 composite_pages """
+        async for page in self.composite_pages(**kwargs):
+            for bucket in page.aggs()[kwargs['agg'].name]:
+                yield bucket
+
+    @params_check(scroll='5m', size=200, limit=1000, slices=1, projection=None, required=['src', 'dst', 'filters'])
+    async def reindex(self, **kwargs):
+        """数据迁移 slices>1 时 sliced scroll 并发读取, 流式批量写入 dst; 返回 BulkReport"""
+
+        async def body():
+            async for page in self.scan(
+                    index=kwargs['src'],
+                    body=kwargs['filters'],
+                    size=kwargs['size'],
+                    scroll=kwargs['scroll'],
+                    slices=kwargs['slices'],
+                    projection=kwargs['projection'],
+            ):
+                for hit in page.hits():
+                    yield {'_id': hit['_id'], **hit_source(hit)}
+
+        return await self.bulk_insert(index=kwargs['dst'], body=body(), limit=kwargs['limit'])
+
+    @params_check(refresh=False, limit=500, size=1000, slices=1, scroll='5m', dead_letter=None, max_failed=1000,
+                  required=['data', 'index', 'body'])
+    async def update_by_query(self, **kwargs):
+        """ 根据查询更新全部匹配数据 scroll 只拉取 _id/_index, 流式批量更新; 返回 BulkReport """
+        if not isinstance(kwargs['data'], dict):
+            raise Exception('update_by_query need param(data) is dict')
+
+        body = dict(kwargs['body'])
+        body.pop('size', None)
+        body.update({'_source': False, 'stored_fields': []})
+
+        async def actions():
+            async for page in self.scan(
+                    index=kwargs['index'],
+                    body=body,
+                    size=kwargs['size'],
+                    scroll=kwargs['scroll'],
+                    slices=kwargs['slices'],
+            ):
+                for hit in page.hits():
+                    yield {
+                        '_id': hit['_id'],
+                        '_op_type': 'update',
+                        '_index': hit['_index'],
+                        'doc': kwargs['data'],
+                    }
+
+        return await self._run_bulk(
+            actions(),
+            BulkReport(kwargs['dead_letter'], kwargs['max_failed']),
+            chunk_size=kwargs['limit'],
+            refresh=kwargs['refresh'],
+        )
+
+    @params_check(required=['body', 'index'], refresh=False, request_timeout=999, wait_for_completion=True,
+                  slices='auto', requests_per_second=None, conflicts=None)
+    async def update_by_script(self, **kwargs):
+        """ 按脚本更新匹配数据 参数同 SimpleESClient.update_by_script
+        wait_for_completion=False 时立即返回 tasks.AsyncESTask
+        """
+        if not (kwargs['body'].get('script') and isinstance(kwargs['body']['script'], dict)):
+            raise Exception('update_by_script need param(body.script) is dict')
+        await self.put_script(kwargs['body']['script'].get('id'))
+
+        params = {
+            'body': kwargs['body'],
+            'index': kwargs['index'],
+            'refresh': kwargs['refresh'],
+            'slices': kwargs['slices'],
+            'wait_for_completion': kwargs['wait_for_completion'],
+            'request_timeout': kwargs['request_timeout']
+        }
+        kwargs['requests_per_second'] and params.update(requests_per_second=kwargs['requests_per_second'])
+        kwargs['conflicts'] and params.update(conflicts=kwargs['conflicts'])
+
+        async with self.semaphore:
+            resp = await self.es.update_by_query(**params)
+        if not kwargs['wait_for_completion']:
+            return AsyncESTask(self.es, resp['task'], 'update_by_query')
+        return resp
+
+    @params_check(required=['body', 'index'])
+    async def exists(self, **kwargs):
+        """ 是否存在 """
+        kwargs['body']['size'] = 0
+        return (await self.search(**kwargs)).total() > 0
+
+    async def put_script(self, script_id: str):
+        """ 注册 sentence.Update 生成的存储脚本 每个 id 只注册一次 """
+        if not script_id or script_id in self.stored_scripts or script_id not in Update.scripts:
+            return
+        await self.es.put_script(id=script_id, body={'script': {'lang': Update.lang, 'source': Update.scripts[script_id]}})
+        self.stored_scripts.add(script_id)
+
+    async def del_index(self, index: str):
+        """删除index"""
+        if await self.es.indices.exists(index):
+            await self.es.indices.delete(index)
+
+    async def create_index(self, index: str, properties: list):
+        """创建index"""
+        if not await self.es.indices.exists(index):
+            mappings = {'mappings': {'properties': dict()}}
+            properties_ = mappings['mappings']['properties']
+            for item in properties:
+                properties_.update(item.get_field())
+            await self.es.indices.create(index=index, body=mappings)
+
+    async def add_alias(self, index: str, alias: str, is_write_index=True):
+        """给index 添加别名"""
+        action = [{
+            'add': {'index': index, 'alias': alias, 'is_write_index': is_write_index}
+        }]
+        await self.es.indices.update_aliases(body={'actions': action})
+
+    async def migrate(self, indices: Dict[str, list]):
+        """
+        批量新建index
+        indices: index列表
+        """
+        await asyncio.gather(*[self.create_index(i, p) for i, p in indices.items()])
@@ -0,0 +1,108 @@
+import time
+import threading
+
+from concurrent.futures import Future
+from typing import List
+
+
+class SearchBatch(object):
+    """
+    显式批量查询 退出 with 块时通过一次 _msearch 提交
+    usage:
+    # >>> with client.batch() as batch:
+    # ...     f1 = batch.search(index='person', body=q1())
+    # ...     f2 = batch.search(index='person', body=q2())
+    # >>> f1.result(), batch.results()
+    """
+
+    def __init__(self, client, max_batch: int = 100):
+        """ max_batch: 单次 _msearch 最多包含的查询数, 超出时分多次提交 """
+        self.client = client
+        self.max_batch = max_batch
+        self.searches = list()
+        self.futures: List[Future] = list()
+
+    def search(self, **kwargs) -> Future:
+        """ 加入批次 参数同 SimpleESClient.search; 返回的 Future 在 flush 后得到 Result """
+        future = Future()
+        self.searches.append(kwargs)
+        self.futures.append(future)
+        return future
+
+    def flush(self):
+        """ 提交尚未提交的查询 """
+        searches, futures = self.searches, self.futures[len(self.futures) - len(self.searches):]
+        self.searches = list()
+        for i in range(0, len(searches), self.max_batch):
+            try:
+                results = self.client.msearch(searches=searches[i:i + self.max_batch])
+            except Exception as e:
+                [f.set_exception(e) for f in futures[i:i + self.max_batch]]
+            else:
+                [f.set_result(r) for f, r in zip(futures[i:i + self.max_batch], results)]
+
+    def results(self) -> list:
+        """ 按加入顺序返回全部 Result """
+        self.searches and self.flush()
+        return [f.result() for f in self.futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        exc_type is None and self.flush()
+
+
+class MSearchBatcher(object):
+    """
+    自动批量查询(多线程)
+    window 时间内各线程发起的查询合并为一次 _msearch, 每个调用仍阻塞等待并得到自己的响应;
+    不启动后台线程, 由每个批次的第一个调用者等待 window 后负责提交
+    """
+
+    def __init__(self, client, window: float = 0.005, max_batch: int = 50):
+        """
+        window: 收集查询的时间窗口(秒)
+        max_batch: 批次达到该数量时立即提交
+        """
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queue = list()
+        self.batches = 0
+        self.searches = 0
+
+    def _take(self):
+        batch, self._queue = self._queue, list()
+        return batch
+
+    def _send(self, batch: list):
+        self.batches += 1
+        self.searches += len(batch)
+        try:
+            responses = self.client.msearch_raw(searches=[kwargs for kwargs, _ in batch])
+        except Exception as e:
+            [f.set_exception(e) for _, f in batch]
+        else:
+            [f.set_result(r) for (_, f), r in zip(batch, responses)]
+
+    def search(self, **kwargs) -> dict:
+        """ 参数同 SimpleESClient.search, 返回原始响应 """
+        future = Future()
+        with self._lock:
+            self._queue.append((kwargs, future))
+            leader = len(self._queue) == 1
+            batch = len(self._queue) >= self.max_batch and self._take()
+
+        if batch:
+            self._send(batch)
+        elif leader:
+            time.sleep(self.window)
+            with self._lock:
+                batch = self._take()
+            batch and self._send(batch)
+        return future.result()
+
+    def stats(self) -> dict:
+        return {'batches': self.batches, 'searches': self.searches}
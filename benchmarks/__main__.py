@@ -0,0 +1,15 @@
+"""
+运行全部基准
+usage:
+# python -m benchmarks [query] [result] [serializer] [bulk] [projection]
+"""
+import sys
+
+from benchmarks import bench_query, bench_result, bench_serializer, bench_bulk, bench_projection
+
+SUITES = {'query': bench_query, 'result': bench_result, 'serializer': bench_serializer, 'bulk': bench_bulk,
+          'projection': bench_projection}
+
+for name in sys.argv[1:] or SUITES:
+    print(f'== {name}')
+    SUITES[name].main()
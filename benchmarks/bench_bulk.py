@@ -0,0 +1,44 @@
+"""
+批量写入 / scroll 吞吐基准 连接本地假 es(benchmarks.fake_es), 可注入延迟与 429
+capacity: 假 es 同时处理的 bulk 数上限, 超出时整批返回 429(模拟过载)
+reject_rate: 每条数据随机返回 429 的概率
+usage:
+# python -m benchmarks.bench_bulk [docs] [latency] [capacity] [reject_rate]
+"""
+import sys
+import logging
+
+from benchmarks.fake_es import FakeES
+from benchmarks.runner import run
+from benchmarks.bench_result import make_page
+from simple_es_client import SimpleESClient
+from elasticsearch import Elasticsearch
+
+
+def make_docs(n: int) -> list:
+    return [hit['_source'] for hit in make_page(n)['hits']['hits']]
+
+
+def main(docs=50000, latency=0.002, capacity=8, reject_rate=0.0):
+    logging.disable(logging.ERROR)
+    data = make_docs(docs)
+    # 不保存写入的文档 内存峰值只统计客户端
+    with FakeES(latency=latency, capacity=capacity or None, reject_rate=reject_rate, store=False) as fake:
+        client = SimpleESClient(Elasticsearch([fake.url], maxsize=32))
+        print(f'fake es: {fake.url} latency={latency}s capacity={capacity} reject_rate={reject_rate}')
+        for adaptive in (False, True):
+            reports = list()
+            run(f'bulk_insert adaptive={adaptive}', ops=docs, rounds=1, warmup=0, fn=lambda: reports.append(
+                client.bulk_insert(index='bench', body=iter(data), adaptive=adaptive, limit=500, threads=4)))
+            print(f'{"":<40}failed={reports[0].failed} retries={reports[0].retries} rejected={reports[0].rejected}')
+
+        fake.capacity, fake.reject_rate = None, 0
+        fake.load('scan', data)
+        for slices in (1, 4):
+            run(f'scan slices={slices}', ops=docs, rounds=1, warmup=0, fn=lambda: sum(
+                len(page.hits()) for page in client.scan(index='scan', body={}, size=1000, slices=slices)))
+        print(fake.stats())
+
+
+if __name__ == '__main__':
+    main(*(t(v) for t, v in zip((int, float, int, float), sys.argv[1:])))
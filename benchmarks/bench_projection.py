@@ -0,0 +1,51 @@
+"""
+字段投影基准: 宽文档 scan 全部 _source vs includes 投影 vs docvalue_fields, 对比吞吐与响应字节数
+usage:
+# python -m benchmarks.bench_projection [docs] [width]
+"""
+import sys
+import logging
+
+from helper import rdm_str
+from benchmarks.fake_es import FakeES
+from benchmarks.runner import run
+from simple_es_client import SimpleESClient
+from sentence import Projection
+from es_fields import IntegerField
+from elasticsearch import Elasticsearch
+
+FIELDS = ['age', 'sex']
+
+
+def make_docs(n: int, width: int) -> list:
+    """ width 个额外的长文本字段 模拟宽文档 """
+    extra = {f'text_{j}': rdm_str(40) for j in range(width)}
+    return [{'age': i % 100, 'sex': i % 2, **extra} for i in range(n)]
+
+
+def main(docs=20000, width=50):
+    logging.disable(logging.ERROR)
+    with FakeES() as fake:
+        fake.load('wide', make_docs(docs, width))
+        client = SimpleESClient(Elasticsearch([fake.url], maxsize=8))
+        properties = [IntegerField(f) for f in FIELDS]
+        cases = {
+            'scan full _source': lambda: sum(len(list(page.tuples(*FIELDS))) for page in client.scan(
+                index='wide', body={}, filter_path=None)),
+            'scan projection': lambda: sum(len(list(page.tuples(*FIELDS))) for page in client.scan(
+                index='wide', body={}, projection=Projection(FIELDS))),
+            'export_columns includes': lambda: client.export_columns(
+                index='wide', body={}, fields=FIELDS, properties=properties),
+            'export_columns docvalue': lambda: client.export_columns(
+                index='wide', body={}, fields=FIELDS, properties=properties, docvalue=True),
+        }
+        rounds = 3
+        for name, fn in cases.items():
+            before = fake.stats().get('bytes_out', 0)
+            run(name, fn, ops=docs, rounds=rounds, warmup=0)
+            # run 另有一轮统计内存
+            print(f'{"":<40}{(fake.stats()["bytes_out"] - before) / (rounds + 1) / docs:.0f} bytes/doc')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
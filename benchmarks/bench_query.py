@@ -0,0 +1,60 @@
+"""
+查询构建基准: 嵌套 Q 树生成 body / Bool.parse_query / 模板渲染
+usage:
+# python -m benchmarks.bench_query [queries] [rounds]
+"""
+import sys
+import datetime
+
+from benchmarks.runner import run
+from sentence import Q, Sort, ESPagination, Collapse, Param, Bool
+
+
+def make_query(i: int = 0) -> Q:
+    """ 业务中常见的组合查询: 多个过滤条件 + 全文匹配 + 嵌套或条件 + 排除条件 """
+    now = datetime.datetime(2022, 1, 1)
+    q = Q.filter('term', sex=i % 2)
+    q += Q.filter('range', age={'gte': 18, 'lt': 60})
+    q += Q.filter('range', birth_day={'from': now - datetime.timedelta(days=365 * 30)})
+    q &= Q.filter('exists', field='life')
+    q &= Q.must('match', name=f'name{i}')
+    q &= Q.must_not('wildcard', name='test*')
+    q |= Q.filter('term', city='beijing') + Q.filter('match_phrase', style='read books')
+    q |= Q.should('term', tag='a') + Q.should('term', tag='b') + Q.must_not('term', deleted=1)
+    return q
+
+
+def build(n: int):
+    sort, pagination, collapse = Sort(age='desc', birth_day='asc'), ESPagination(page=3), Collapse('name')
+    for i in range(n):
+        make_query(i)(sort=sort, pagination=pagination, collapse=collapse)
+
+
+def compile_(n: int, q: Q, optimize: bool = False):
+    for _ in range(n):
+        q(optimize=optimize)
+
+
+def parse(n: int, q: Q):
+    bool_ = q.queries[0].items[0]
+    for _ in range(n):
+        [Bool.parse_query(item) for item in bool_.queries]
+
+
+def render(n: int):
+    tpl = (Q.filter('term', sex=Param('sex')) + make_query()).compile(sort=Sort(age='desc'))
+    for i in range(n):
+        tpl.render(sex=i % 2)
+
+
+def main(queries=2000, rounds=5):
+    q = make_query()
+    run('build Q tree + __call__', lambda: build(queries), ops=queries, rounds=rounds)
+    run('Q.__call__ (prebuilt tree)', lambda: compile_(queries, q), ops=queries, rounds=rounds)
+    run('Q.__call__ optimize=True', lambda: compile_(queries, q, True), ops=queries, rounds=rounds)
+    run('Bool.parse_query', lambda: parse(queries, q), ops=queries, rounds=rounds)
+    run('Template.render', lambda: render(queries), ops=queries, rounds=rounds)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""
+Result 解码基准: Condition 行 vs 惰性 Row vs tuple 投影 vs Document 模型 vs 列
+usage:
+# python -m benchmarks.bench_result [hits] [rounds]
+"""
+import sys
+
+from helper import rdm_str
+from benchmarks.runner import run
+from sentence import Result
+from document import Document
+from es_fields import IntegerField, DateField, KeywordField, ESObjectField
+
+PROPERTIES = [IntegerField('age'), IntegerField('sex'), DateField('birth_day'), IntegerField('life.city.code')]
+
+
+
+class Person(Document):
+    name = KeywordField()
+    age = IntegerField()
+    sex = IntegerField()
+    birth_day = DateField()
+    life = ESObjectField()
+
+
+def make_page(n: int) -> dict:
+    """ 构造 n 条带嵌套对象的 hit """
+    return {'hits': {'total': {'value': n}, 'hits': [{
+        '_id': str(i),
+        '_index': 'person',
+        '_source': {
+            'name': rdm_str(10),
+            'age': i % 100,
+            'sex': i % 2,
+            'birth_day': '2000-01-01 00:00:00',
+            'life': {'style': rdm_str(50), 'city': {'name': rdm_str(8), 'code': i}},
+        },
+    } for i in range(n)]}}
+
+
+def decode_condition(page):
+    for row in Result(page):
+        row.name, row.life['city']['code']
+
+
+def decode_row(page):
+    for row in Result(page).rows():
+        row.name, row.life.city.code
+
+
+def decode_tuple(page):
+    for _ in Result(page).tuples('name', 'life.city.code'):
+        pass
+
+
+def decode_document(page):
+    for row in Result(page).documents(Person):
+        row.name, row.life['city']['code']
+
+
+def collect_condition(page):
+    """ 保留全部行 对比内存 """
+    return list(Result(page))
+
+
+def collect_columns(page):
+    return Result(page).to_columns(['_id', 'age', 'sex', 'birth_day', 'life.city.code'], PROPERTIES)
+
+
+def main(hits=10000, rounds=20):
+    page = make_page(hits)
+    for fn in (decode_condition, decode_row, decode_tuple, decode_document, collect_condition, collect_columns):
+        run(fn.__name__, lambda: fn(page), ops=hits, rounds=rounds)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
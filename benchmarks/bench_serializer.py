@@ -0,0 +1,54 @@
+"""
+序列化基准: 标准库 + helper.JsonDecoder / FastJSONSerializer
+usage:
+# python -m benchmarks.bench_serializer [docs] [rounds]
+"""
+import sys
+import json
+import uuid
+import decimal
+import datetime
+import timeit
+
+from helper import rdm_str, JsonDecoder
+from serializer import FastJSONSerializer, orjson
+from elasticsearch.serializer import JSONSerializer
+
+
+def make_docs(n: int) -> list:
+    now = datetime.datetime(2022, 1, 1, 12, 30, 15)
+    return [{
+        'name': rdm_str(10),
+        'age': i % 100,
+        'score': decimal.Decimal('12.50'),
+        'uid': uuid.UUID(int=i),
+        'birth_day': now.date(),
+        'pulled_at': now,
+        'cost': datetime.timedelta(seconds=i),
+        'life': {'style': rdm_str(50), 'tags': ['a', 'b', 'c']},
+    } for i in range(n)]
+
+
+class JsonDecoderSerializer(JSONSerializer):
+    """ 以 helper.JsonDecoder 为编码器的标准库序列化 """
+
+    def dumps(self, data):
+        return json.dumps(data, cls=JsonDecoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def main(docs=10000, rounds=10):
+    data = make_docs(docs)
+    fast = FastJSONSerializer()
+    reference = JsonDecoderSerializer()
+    assert all(fast.dumps(d) == reference.dumps(d) for d in data[:100]), 'output differs from JsonDecoder'
+
+    print(f'orjson: {"yes" if orjson else "no"}')
+    for name, serializer in (('JsonDecoder', reference), ('FastJSONSerializer', fast)):
+        dumps = timeit.timeit(lambda: [serializer.dumps(d) for d in data], number=rounds) / rounds
+        payload = '\n'.join(serializer.dumps(d) for d in data)
+        loads = timeit.timeit(lambda: [serializer.loads(line) for line in payload.split('\n')], number=rounds) / rounds
+        print(f'{name:<20} dumps {docs / dumps:>12.0f} docs/s   loads {docs / loads:>12.0f} docs/s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,259 @@
+"""
+本地假 es 服务 用于基准测试, 只实现 _bulk / _search / _msearch / scroll 所需的最小接口
+数据保存在内存中(store=False 时 bulk 只计数), 不解析查询条件(query 总是匹配全部文档), 支持 sliced scroll 与 _source/docvalue_fields 投影
+可注入每个请求的延迟与 bulk 429 拒绝(随机拒绝, 或模拟写入线程池排满时的过载拒绝)
+usage:
+# >>> with FakeES(latency=0.002, capacity=4) as fake:
+# ...     client = SimpleESClient(Elasticsearch([fake.url]))
+# ...     client.bulk_insert(index='person', body=docs)
+# >>> fake.stats()
+"""
+import gzip
+import json
+import time
+import random
+import threading
+
+from uuid import uuid4
+from contextlib import contextmanager
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: "_Server"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.server.fake._count('bytes_out', len(data))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        body = body.decode('utf-8')
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        fake: FakeES = self.server.fake
+
+        with fake.track() as overloaded:
+            fake.latency and time.sleep(fake.latency)
+            path = [p for p in url.path.split('/') if p]
+            status, resp = fake.dispatch(self.command, path, params, body, overloaded)
+        self._reply(status, resp)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fake: "FakeES" = None
+
+
+class FakeES(object):
+    """
+    latency: 每个请求的固定延迟(秒)
+    reject_rate: bulk 中每条数据返回 429 的概率
+    capacity: 同时处理的 bulk 请求数上限, 超出的请求中全部数据返回 429; 为空时不限制
+    seed: 拒绝采用的随机种子, 保证多次运行可比较
+    store: 是否保存 bulk 写入的文档; False 时只计数不解析 _source, 内存统计(tracemalloc)只反映客户端
+    """
+
+    def __init__(self, latency: float = 0, reject_rate: float = 0, capacity: int = None, host: str = '127.0.0.1',
+                 port: int = 0, seed: int = 0, store: bool = True):
+        self.latency = latency
+        self.store = store
+        self.reject_rate = reject_rate
+        self.capacity = capacity
+        self.random = random.Random(seed)
+        self.in_flight = 0
+
+        self._lock = threading.Lock()
+        self.docs = defaultdict(dict)
+        self.scrolls = dict()
+        self.counters = defaultdict(int)
+
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> "FakeES":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def load(self, index: str, docs: list):
+        """ 预置数据 docs 中的 _id 作为文档ID """
+        store = self.docs[index]
+        for i, doc in enumerate(docs):
+            doc = dict(doc)
+            store[str(doc.pop('_id', i))] = doc
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+            overloaded = self.capacity is not None and self.in_flight > self.capacity
+        try:
+            yield overloaded
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def stats(self) -> dict:
+        return {**self.counters, 'docs': {k: len(v) for k, v in self.docs.items()}}
+
+    def dispatch(self, method: str, path: list, params: dict, body: str, overloaded: bool = False):
+        self._count('requests')
+        if not path:
+            return 200, {'version': {'number': '7.10.0'}, 'tagline': 'You Know, for Search'}
+
+        if path[-1] == '_bulk':
+            return self.bulk(path[0] if len(path) > 1 else None, body, overloaded)
+
+        if path[:2] == ['_search', 'scroll']:
+            data = json.loads(body) if body else params
+            if method == 'DELETE':
+                ids = data.get('scroll_id') or []
+                [self.scrolls.pop(i, None) for i in ([ids] if isinstance(ids, str) else ids)]
+                return 200, {'succeeded': True, 'num_freed': len(ids)}
+            return self.scroll(data['scroll_id'])
+
+        if path[-1] == '_msearch':
+            lines = [json.loads(line) for line in body.splitlines() if line]
+            return 200, {'took': 1, 'responses': [
+                self.search(header['index'], dict(), search)[1] for header, search in zip(lines[::2], lines[1::2])
+            ]}
+
+        if path[-1] == '_search':
+            return self.search(path[0], params, json.loads(body) if body else {})
+
+        if method == 'HEAD':
+            return (200 if path[0] in self.docs else 404), {}
+        return 404, {'error': f'unsupported {method} /{"/".join(path)}', 'status': 404}
+
+    def bulk(self, default_index: str, body: str, overloaded: bool = False):
+        lines = body.splitlines()
+        items, errors, i = list(), False, 0
+        while i < len(lines):
+            (op_type, meta), = json.loads(lines[i]).items()
+            source = json.loads(lines[i + 1]) if op_type != 'delete' and self.store else None
+            i += 1 if op_type == 'delete' else 2
+
+            index = meta.get('_index', default_index)
+            doc_id = str(meta.get('_id') or uuid4().hex)
+            item = {'_index': index, '_id': doc_id}
+            with self._lock:
+                rejected = overloaded or (self.reject_rate and self.random.random() < self.reject_rate)
+            if rejected:
+                errors = True
+                item.update(status=429, error={'type': 'es_rejected_execution_exception', 'reason': 'fake reject'})
+            else:
+                self.store and self._write(index, op_type, doc_id, source)
+                item.update(status=201 if op_type in ('index', 'create') else 200, result='created')
+            items.append({op_type: item})
+        self._count('bulks')
+        self._count('rejected', sum(1 for item in items if list(item.values())[0]['status'] == 429))
+        self._count('indexed', sum(1 for item in items if list(item.values())[0]['status'] != 429))
+        return 200, {'took': 1, 'errors': errors, 'items': items}
+
+    def _write(self, index: str, op_type: str, doc_id: str, source: dict):
+        store = self.docs[index]
+        if op_type == 'delete':
+            store.pop(doc_id, None)
+        elif op_type == 'update':
+            store.setdefault(doc_id, dict()).update(source.get('doc') or {})
+        else:
+            store[doc_id] = source
+
+    @staticmethod
+    def _lookup(source: dict, field: str):
+        for key in field.split('.'):
+            if not isinstance(source, dict):
+                return None
+            source = source.get(key)
+        return source
+
+    def _hit(self, index: str, doc_id: str, source: dict, body: dict) -> dict:
+        """ 按 _source(顶层字段的 includes/excludes) 与 docvalue_fields 投影 """
+        hit = {'_index': index, '_id': doc_id, '_score': 1.0}
+        spec = body.get('_source', True)
+        if spec is not False:
+            if isinstance(spec, (list, str)):
+                spec = {'includes': [spec] if isinstance(spec, str) else spec}
+            includes = isinstance(spec, dict) and spec.get('includes') or None
+            excludes = isinstance(spec, dict) and spec.get('excludes') or ()
+            if includes is not None:
+                source = {k: source[k] for k in dict.fromkeys(i.split('.')[0] for i in includes) if k in source}
+            hit['_source'] = {k: v for k, v in source.items() if k not in excludes} if excludes else source
+        docvalues = [f if isinstance(f, str) else f['field'] for f in body.get('docvalue_fields') or ()]
+        if docvalues:
+            values = {f: self._lookup(source, f) for f in docvalues}
+            hit['fields'] = {f: [v] for f, v in values.items() if v is not None}
+        return hit
+
+    def _hits(self, index: str, ids: list, body: dict = None) -> list:
+        store = self.docs[index]
+        return [self._hit(index, i, store[i], body or {}) for i in ids if i in store]
+
+    def _page(self, index: str, ids: list, total: int, scroll_id: str = None, body: dict = None) -> dict:
+        resp = {'took': 1, 'timed_out': False, 'hits': {'total': {'value': total, 'relation': 'eq'},
+                                                        'hits': self._hits(index, ids, body)}}
+        scroll_id and resp.update(_scroll_id=scroll_id)
+        return resp
+
+    def search(self, index: str, params: dict, body: dict):
+        self._count('searches')
+        ids = list(self.docs[index])
+        if body.get('slice'):
+            slice_id, slice_max = body['slice']['id'], body['slice']['max']
+            ids = [i for n, i in enumerate(ids) if n % slice_max == slice_id]
+
+        size = int(params.get('size', body.get('size', 10)))
+        start = int(body.get('from', 0))
+        if 'scroll' not in params:
+            return 200, self._page(index, ids[start:start + size], len(ids), body=body)
+
+        scroll_id = uuid4().hex
+        self.scrolls[scroll_id] = (index, ids, size, size, body)
+        return 200, self._page(index, ids[:size], len(ids), scroll_id, body)
+
+    def scroll(self, scroll_id: str):
+        self._count('scrolls')
+        if scroll_id not in self.scrolls:
+            return 404, {'error': 'search_context_missing_exception', 'status': 404}
+
+        index, ids, size, offset, body = self.scrolls[scroll_id]
+        self.scrolls[scroll_id] = (index, ids, size, offset + size, body)
+        return 200, self._page(index, ids[offset:offset + size], len(ids), scroll_id, body)
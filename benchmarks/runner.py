@@ -0,0 +1,45 @@
+"""
+基准测试计时工具 输出 ops/sec 与峰值内存
+计时与内存分两次运行: tracemalloc 会显著拖慢执行, 只在单独的一轮中开启
+"""
+import gc
+import time
+import tracemalloc
+
+from typing import Callable
+
+
+def measure(name: str, fn: Callable, ops: int = 1, rounds: int = 5, warmup: int = 1) -> dict:
+    """
+    fn: 无参函数, 每次调用完成 ops 次操作
+    rounds: 计时轮数, 取最快的一轮
+    """
+    [fn() for _ in range(warmup)]
+
+    costs = list()
+    for _ in range(rounds):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        costs.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(costs)
+    return {'name': name, 'ops': ops, 'best': best, 'ops_per_sec': ops / best if best else 0, 'peak_bytes': peak}
+
+
+def report(result: dict):
+    print(f"{result['name']:<40}{result['ops_per_sec']:>14,.0f} ops/s"
+          f"{result['best'] * 1000:>12.2f} ms{result['peak_bytes'] / 1024 / 1024:>10.2f} MiB peak")
+    return result
+
+
+def run(name: str, fn: Callable, ops: int = 1, rounds: int = 5, warmup: int = 1) -> dict:
+    return report(measure(name, fn, ops=ops, rounds=rounds, warmup=warmup))
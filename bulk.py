@@ -0,0 +1,432 @@
+import json
+import time
+import threading
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch.exceptions import TransportError
+from helper import json_dump
+
+# 单个批次的统计 latency 为首次提交的耗时, 不含重试等待
+BatchStat = namedtuple('BatchStat', ['docs', 'bytes', 'latency', 'failed', 'rejected', 'retries', 'chunk_size', 'concurrency'])
+
+
+class BulkWriter(object):
+    """
+    流式批量写入
+    按文档数(chunk_size)和字节数(max_chunk_bytes)懒切分 actions,
+    最多 queue_size 个批次同时在途, 内存占用与输入总量无关
+    usage:
+    # >>> writer = BulkWriter(es, chunk_size=1000, threads=4, refresh=False)
+    # >>> for success, info in writer.run(actions): ...
+    # >>> writer.stats  # 最近的 BatchStat
+    """
+
+    def __init__(self,
+                 es: Elasticsearch,
+                 chunk_size: int = 500,
+                 max_chunk_bytes: int = 100 * 1024 * 1024,
+                 threads: int = 4,
+                 queue_size: int = None,
+                 stats_size: int = 1000,
+                 **params):
+        """
+        chunk_size: 每批最多文档数
+        max_chunk_bytes: 每批最大字节数
+        threads: 线程数
+        queue_size: 最多同时在途的批次数, 默认等于 threads
+        stats_size: 保留最近多少个批次的统计
+        params: 透传给 es.bulk 的参数, 如 refresh
+        """
+        self.es: Elasticsearch = es
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.threads = max(threads, 1)
+        self.queue_size = max(queue_size or self.threads, 1)
+        self.params = params
+        self.serializer = es.transport.serializer
+        self.stats = deque(maxlen=stats_size)
+
+    def encode(self, data: dict) -> Tuple[tuple, List[str], int]:
+        """ 序列化一条 action 返回 (bulk_data 条目, bulk 行, 字节数) """
+        action, source = helpers.expand_action(data)
+        if source is None:
+            item, lines = (action,), [self.serializer.dumps(action)]
+        else:
+            item, lines = (action, source), [self.serializer.dumps(action), self.serializer.dumps(source)]
+        # +1 换行符
+        return item, lines, sum(len(line.encode('utf-8')) + 1 for line in lines)
+
+    def chunks(self, actions: Iterable, on_invalid: Callable = None) -> Iterator[Tuple[list, List[str]]]:
+        """ 懒切分 产出 (bulk_data, bulk_lines); chunk_size 与 max_chunk_bytes 每条都重新读取, 可在运行中调整
+        on_invalid: 无法序列化的 action 交给回调 on_invalid(data, error) 并跳过, 为空时抛出异常
+        """
+        bulk_data, lines, size = list(), list(), 0
+
+        for data in actions:
+            try:
+                item, cur_lines, cur_size = self.encode(data)
+            except Exception as e:
+                if not callable(on_invalid):
+                    raise
+                on_invalid(data, e)
+                continue
+            if bulk_data and (size + cur_size > self.max_chunk_bytes or len(bulk_data) >= self.chunk_size):
+                yield bulk_data, lines
+                bulk_data, lines, size = list(), list(), 0
+
+            bulk_data.append(item)
+            lines.extend(cur_lines)
+            size += cur_size
+
+        if bulk_data:
+            yield bulk_data, lines
+
+    @staticmethod
+    def status(info: dict) -> int:
+        """ (success, info) 中 info 的状态码 """
+        for item in info.values():
+            return item.get('status')
+
+    def _bulk(self, bulk_data: list, lines: List[str]) -> List[Tuple[bool, dict]]:
+        try:
+            resp = self.es.bulk('\n'.join(lines) + '\n', **self.params)
+        except TransportError as e:
+            ret = list()
+            for data in bulk_data:
+                op_type, action = data[0].copy().popitem()
+                info = {'error': str(e), 'status': e.status_code, **action}
+                len(data) > 1 and info.update(data=data[1])
+                ret.append((False, {op_type: info}))
+            return ret
+
+        ret = list()
+        for data, item in zip(bulk_data, resp['items']):
+            op_type, info = item.popitem()
+            success = 200 <= info.get('status', 500) < 300
+            (not success) and len(data) > 1 and info.update(data=data[1])
+            ret.append((success, {op_type: info}))
+        return ret
+
+    def send(self, bulk_data: list, lines: List[str]) -> List[Tuple[bool, dict]]:
+        """ 提交一个批次 返回 [(success, info)] """
+        start = time.monotonic()
+        ret = self._bulk(bulk_data, lines)
+        failed = sum(1 for success, _ in ret if not success)
+        rejected = sum(1 for success, info in ret if not success and self.status(info) == 429)
+        self.record(BatchStat(
+            len(bulk_data), sum(len(line) + 1 for line in lines), time.monotonic() - start,
+            failed, rejected, 0, self.chunk_size, self.queue_size,
+        ))
+        return ret
+
+    def record(self, stat: BatchStat):
+        self.stats.append(stat)
+
+    def _pending_limit(self) -> int:
+        """ 已提交未完成的批次数上限 """
+        return self.queue_size
+
+    def run(self, actions: Iterable, on_invalid: Callable = None) -> Iterator[Tuple[bool, dict]]:
+        """ 执行写入 按提交顺序产出每条数据的 (success, info); on_invalid 见 chunks """
+        with ThreadPoolExecutor(max(self.threads, self.queue_size)) as pool:
+            pending = deque()
+            for bulk_data, lines in self.chunks(actions, on_invalid):
+                # 在途批次达到上限时 等待最早的批次完成 保持内存稳定
+                while len(pending) >= self._pending_limit():
+                    yield from pending.popleft().result()
+                pending.append(pool.submit(self.send, bulk_data, lines))
+
+            while pending:
+                yield from pending.popleft().result()
+
+
+class AdaptiveBulkWriter(BulkWriter):
+    """
+    自适应批量写入
+    从 chunk_size/threads 出发, 每完成一轮(当前并发数个)批次测量一次吞吐:
+    批次大小沿当前方向调整, 吞吐下降则反向, 使吞吐保持在峰值附近; 并发逐轮加一;
+    一批中 429(es_rejected_execution_exception) 的条目占比超过 reject_ratio 时并发减半, 单批耗时超过 max_latency 时批次减半;
+    只重试被拒绝的条目: 零星拒绝立即重试, 否则指数退避, 退避等待期间不占用并发名额, 其它批次照常提交
+    """
+
+    def __init__(self,
+                 es: Elasticsearch,
+                 chunk_size: int = 500,
+                 max_chunk_bytes: int = 100 * 1024 * 1024,
+                 threads: int = 4,
+                 min_chunk_size: int = 50,
+                 max_chunk_size: int = 10000,
+                 max_threads: int = None,
+                 max_latency: float = 10,
+                 max_retries: int = 5,
+                 initial_backoff: float = 0.5,
+                 max_backoff: float = 30,
+                 reject_ratio: float = 0.1,
+                 **params):
+        """
+        min_chunk_size/max_chunk_size: 批次文档数的调整范围
+        max_threads: 最大并发批次数, 默认 threads*2
+        max_latency: 单批耗时超过该值(秒)时缩小批次
+        max_retries: 429 条目的最大重试次数
+        initial_backoff/max_backoff: 重试等待时间(秒), 每次翻倍
+        reject_ratio: 首次提交中被拒绝条目的占比超过该值时降低并发, 零星的 429 只重试不降速
+        """
+        max_threads = max(max_threads or threads * 2, threads, 1)
+        super().__init__(es, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                         threads=max_threads, queue_size=threads, **params)
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_latency = max_latency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.reject_ratio = reject_ratio
+
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._active = 0
+        self._direction = 1
+        self._throughput = 0
+        self._window_docs = 0
+        self._window_batches = 0
+        self._window_start = time.monotonic()
+
+    @staticmethod
+    def _select(bulk_data: list, lines: List[str], indexes: List[int]):
+        """ 取出部分条目对应的 bulk_data 与 lines """
+        offsets, pos = list(), 0
+        for data in bulk_data:
+            offsets.append(pos)
+            pos += len(data)
+
+        sub_data, sub_lines = list(), list()
+        for i in indexes:
+            sub_data.append(bulk_data[i])
+            sub_lines.extend(lines[offsets[i]:offsets[i] + len(bulk_data[i])])
+        return sub_data, sub_lines
+
+    def send(self, bulk_data: list, lines: List[str]) -> List[Tuple[bool, dict]]:
+        chunk_size, concurrency = self.chunk_size, self.queue_size
+        ret = [None] * len(bulk_data)
+        todo = list(range(len(bulk_data)))
+        latency, rejected, retries = 0, 0, 0
+
+        for attempt in range(self.max_retries + 1):
+            sub_data, sub_lines = (bulk_data, lines) if attempt == 0 else self._select(bulk_data, lines, todo)
+            items, elapsed = self._request(sub_data, sub_lines)
+            if attempt == 0:
+                latency = elapsed
+
+            for i, item in zip(todo, items):
+                ret[i] = item
+            todo = [i for i, (success, info) in zip(todo, items) if not success and self.status(info) == 429]
+            if attempt == 0:
+                rejected = len(todo)
+            if not todo or attempt == self.max_retries:
+                break
+
+            retries += 1
+            # 只有零星条目被拒绝时立即重试, 否则指数退避
+            if len(todo) > len(bulk_data) * self.reject_ratio:
+                time.sleep(min(self.initial_backoff * 2 ** attempt, self.max_backoff))
+
+        self.record(BatchStat(
+            len(bulk_data), sum(len(line) + 1 for line in lines), latency,
+            sum(1 for success, _ in ret if not success), rejected, retries, chunk_size, concurrency,
+        ))
+        return ret
+
+    def _pending_limit(self) -> int:
+        # 退避中的批次不占并发名额, 允许最多 threads 个批次已提交
+        return self.threads
+
+    def _request(self, bulk_data: list, lines: List[str]) -> Tuple[List[Tuple[bool, dict]], float]:
+        """ 占用一个并发名额提交请求 同时发出的请求数不超过当前 queue_size; 返回 (结果, 不含排队的耗时) """
+        with self._slots:
+            self._slots.wait_for(lambda: self._active < self.queue_size)
+            self._active += 1
+        try:
+            start = time.monotonic()
+            return self._bulk(bulk_data, lines), time.monotonic() - start
+        finally:
+            with self._slots:
+                self._active -= 1
+                self._slots.notify_all()
+
+    def record(self, stat: BatchStat):
+        super().record(stat)
+        with self._lock:
+            if stat.rejected > stat.docs * self.reject_ratio:
+                # 429 过多: 并发减半(乘性减); 降并发前提交的批次不再重复降低
+                if stat.concurrency <= self.queue_size:
+                    self.queue_size = max(1, self.queue_size // 2)
+                    self._reset_window()
+                return
+
+            if stat.latency > self.max_latency:
+                # 单批过慢: 批次减半
+                if stat.chunk_size <= self.chunk_size:
+                    self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+                    self._direction = -1
+                    self._reset_window()
+                return
+
+            self._window_docs += stat.docs
+            self._window_batches += 1
+            if self._window_batches < self.queue_size:
+                return
+
+            # 批次大小爬山: 吞吐下降超过 5% 时反向
+            throughput = self._window_docs / max(time.monotonic() - self._window_start, 1e-6)
+            if throughput < self._throughput * 0.95:
+                self._direction = -self._direction
+            self._throughput = throughput
+
+            if self._direction > 0:
+                self.chunk_size = min(self.max_chunk_size, int(self.chunk_size * 1.5))
+            else:
+                self.chunk_size = max(self.min_chunk_size, int(self.chunk_size / 1.5))
+            # 并发加性增
+            self.queue_size = min(self.threads, self.queue_size + 1)
+            self._reset_window()
+        with self._slots:
+            self._slots.notify_all()
+
+    def _reset_window(self):
+        self._window_docs = 0
+        self._window_batches = 0
+        self._window_start = time.monotonic()
+
+
+class JsonlDeadLetter(object):
+    """ 死信文件 每条失败数据追加一行 json, 可通过 SimpleESClient.bulk_replay 重新写入 """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __call__(self, record: dict):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json_dump(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file and self._file.close()
+            self._file = None
+
+
+def read_dead_letters(path: str) -> Iterator[dict]:
+    """ 逐行读取死信文件 还原为 bulk action; 无法生成 action 的原始文档(op_type 为空)会跳过 """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not record.get('op_type'):
+                continue
+            action = {**record['meta'], '_op_type': record['op_type']}
+            record.get('data') is not None and action.update(_source=record['data'])
+            yield action
+
+
+class BulkReport(object):
+    """
+    批量写入报告
+    计数、耗时、每批统计, 以及最多 max_failed 条失败明细;
+    全部失败数据(含无法生成 action 的文档)同时写入 dead_letter, 便于之后重放
+    """
+
+    META = ('_index', '_id', '_type', '_routing', 'routing', 'retry_on_conflict')
+
+    def __init__(self, dead_letter: Union[str, Callable] = None, max_failed: int = 1000):
+        """
+        dead_letter: 死信 jsonl 文件路径或回调 callback(record)
+        max_failed: 报告中保留的失败明细条数上限
+        """
+        if isinstance(dead_letter, str):
+            dead_letter = JsonlDeadLetter(dead_letter)
+        self.dead_letter = dead_letter
+        self.max_failed = max_failed
+
+        self.total = 0
+        self.success = 0
+        self.failed = 0
+        self.invalid = 0
+        self.dead_letters = 0
+        self.failed_items = list()
+        self.batches = list()
+        self.elapsed = 0
+        self._start = time.monotonic()
+
+    def _fail(self, record: dict):
+        self.failed += 1
+        len(self.failed_items) < self.max_failed and self.failed_items.append(record)
+        if callable(self.dead_letter):
+            self.dead_letter(record)
+            self.dead_letters += 1
+
+    def add(self, success: bool, info: dict):
+        """ 记录 BulkWriter.run 产出的一条结果 """
+        self.total += 1
+        if success:
+            self.success += 1
+            return
+
+        op_type, item = next(iter(info.items()))
+        error = item.get('error')
+        self._fail({
+            'op_type': op_type,
+            'meta': {k: item[k] for k in self.META if item.get(k) is not None},
+            'status': item.get('status'),
+            'reason': error if isinstance(error, str) else json_dump(error),
+            'data': item.get('data'),
+        })
+
+    def add_invalid(self, data, error: Exception):
+        """ 记录无法生成 action 的文档 """
+        self.total += 1
+        self.invalid += 1
+        self._fail({'op_type': None, 'meta': {}, 'status': None, 'reason': f'invalid document: {error!r}', 'data': data})
+
+    def finish(self, writer: BulkWriter = None):
+        self.elapsed = time.monotonic() - self._start
+        writer is not None and self.batches.extend(writer.stats)
+        if isinstance(self.dead_letter, JsonlDeadLetter):
+            self.dead_letter.close()
+        return self
+
+    @property
+    def docs_per_sec(self):
+        return self.total / self.elapsed if self.elapsed else 0
+
+    @property
+    def retries(self):
+        return sum(b.retries for b in self.batches)
+
+    @property
+    def rejected(self):
+        return sum(b.rejected for b in self.batches)
+
+    def to_dict(self) -> dict:
+        return {
+            'total': self.total,
+            'success': self.success,
+            'failed': self.failed,
+            'invalid': self.invalid,
+            'dead_letters': self.dead_letters,
+            'rejected': self.rejected,
+            'retries': self.retries,
+            'batches': len(self.batches),
+            'elapsed': self.elapsed,
+            'docs_per_sec': self.docs_per_sec,
+        }
+
+    def __repr__(self):
+        return f'BulkReport({self.to_dict()})'
@@ -0,0 +1,212 @@
+import time
+import asyncio
+import fnmatch
+import threading
+
+from collections import OrderedDict, defaultdict
+from helper import md5, json_dump
+
+
+class QueryCache(object):
+    """
+    查询结果缓存 LRU 淘汰 + 单条 TTL + 内存上限
+    写入同一 index 时由 SimpleESClient 调用 invalidate 使缓存失效; 请求前取 generation, 请求期间发生失效时不写入缓存
+    index 按字符串(及缓存时的通配符)匹配, 不解析 alias: 以 alias 缓存的查询不会因直接写入 alias 指向的 index 而失效,
+    写入时请使用同一 alias, 或手动调用 invalidate(alias)
+    缓存的是原始响应 dict, 多个调用方共享同一对象, 不要原地修改
+    usage:
+    # >>> client = SimpleESClient(es, cache=QueryCache(max_entries=1024, ttl=10))
+    # >>> client.cache.stats()
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 10, max_bytes: int = 64 * 1024 * 1024):
+        """
+        max_entries: 最大条数
+        ttl: 单条缓存有效期(秒)
+        max_bytes: 缓存总大小上限, 以响应序列化后的长度估算; 超过上限的单条响应不缓存
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        self._lock = threading.RLock()
+        # key -> (expire_at, size, indices, value)
+        self._entries = OrderedDict()
+        # index -> {key}
+        self._indices = defaultdict(set)
+        # index(或通配符) -> 失效次数
+        self._generations = defaultdict(int)
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(index, body, _source=None) -> str:
+        """ (index, body, _source) 规范化后的哈希 """
+        return md5(json_dump([index, body, _source], sort_keys=True))
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def generation(self, index: str) -> tuple:
+        """ 请求前调用 作为 set 的 generation 参数 """
+        with self._lock:
+            return tuple(self._generations[i] for i in filter(None, str(index).split(',')))
+
+    def set(self, key: str, index: str, value: dict, generation: tuple = None):
+        """ generation: 请求前的 generation(index), 与当前不同(请求期间有写入)时不缓存 """
+        size = len(json_dump(value))
+        if size > self.max_bytes:
+            return
+
+        indices = tuple(filter(None, str(index).split(',')))
+        with self._lock:
+            if generation is not None and generation != tuple(self._generations[i] for i in indices):
+                return
+            key in self._entries and self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, indices, value)
+            [self._indices[i].add(key) for i in indices]
+            self.bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, index: str):
+        """ 清除与 index 相关的缓存, 缓存时使用的通配符 index 也会匹配 """
+        with self._lock:
+            for name in filter(None, str(index).split(',')):
+                for pattern in [i for i in self._generations if i == name or fnmatch.fnmatchcase(name, i)]:
+                    self._generations[pattern] += 1
+                for pattern in [i for i in self._indices if i == name or fnmatch.fnmatchcase(name, i)]:
+                    for key in list(self._indices.get(pattern, ())):
+                        self._drop(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indices.clear()
+            for i in self._generations:
+                self._generations[i] += 1
+            self.bytes = 0
+
+    def _drop(self, key: str):
+        _, size, indices, _ = self._entries.pop(key)
+        self.bytes -= size
+        for i in indices:
+            keys = self._indices.get(i)
+            if keys is not None:
+                keys.discard(key)
+                keys or self._indices.pop(i)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight(object):
+    """
+    合并并发的相同请求(多线程)
+    同一 key 同时只有一个请求在途, 其余调用阻塞等待并共享它的结果或异常
+    usage:
+    # >>> client = SimpleESClient(es, single_flight=SingleFlight())
+    """
+
+    class _Call(object):
+        __slots__ = ('event', 'result', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self.leaders = 0
+        self.collapsed = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.leaders += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self) -> dict:
+        return {'leaders': self.leaders, 'collapsed': self.collapsed, 'in_flight': len(self._calls)}
+
+
+class AsyncSingleFlight(object):
+    """
+    合并并发的相同请求(asyncio)
+    首个调用创建的任务被所有相同 key 的调用共享; 单个调用被取消不影响其它等待者
+    usage:
+    # >>> client = AsyncSimpleESClient(es, single_flight=AsyncSingleFlight())
+    """
+
+    def __init__(self):
+        self._calls = dict()
+        self.leaders = 0
+        self.collapsed = 0
+
+    async def do(self, key: str, fn):
+        """ fn: 无参协程函数 """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._calls.get(key) is t and self._calls.pop(key))
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {'leaders': self.leaders, 'collapsed': self.collapsed, 'in_flight': len(self._calls)}
@@ -0,0 +1,218 @@
+import re
+import math
+import datetime
+
+from array import array
+from typing import Callable, List
+from es_fields import ESTypeMapping, ESBaseField
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 缺失的日期, 与 numpy.datetime64('NaT') 的整数表示相同
+NAT = -2 ** 63
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# es 类型 -> (numpy dtype, array 类型码, 缺失值); 缺失值为 None 的类型有缺失时改用 NULLABLE
+TYPES = {
+    ESTypeMapping.Long: ('int64', 'q', None),
+    ESTypeMapping.Integer: ('int32', 'i', None),
+    ESTypeMapping.Short: ('int16', 'h', None),
+    ESTypeMapping.Byte: ('int8', 'b', None),
+    ESTypeMapping.UnsignedLong: ('uint64', 'Q', None),
+    ESTypeMapping.Double: ('float64', 'd', math.nan),
+    ESTypeMapping.Float: ('float32', 'f', math.nan),
+    ESTypeMapping.HalfFloat: ('float16', 'f', math.nan),
+    ESTypeMapping.ScaledFloat: ('float64', 'd', math.nan),
+    ESTypeMapping.Boolean: ('bool', 'b', None),
+    ESTypeMapping.Date: ('datetime64[ms]', 'q', NAT),
+}
+# 有缺失值的整数列转为浮点, 缺失为 nan(超过 2**53 的整数会损失精度)
+NULLABLE = ('float64', 'd', math.nan)
+
+# java 日期格式 -> strptime 格式, 其余字母不支持
+_JAVA_DATE = {'yyyy': '%Y', 'uuuu': '%Y', 'yy': '%y', 'MM': '%m', 'dd': '%d', 'HH': '%H', 'mm': '%M', 'ss': '%S',
+              'SSS': '%f', 'Z': '%z', 'XXX': '%z', 'X': '%z'}
+
+
+def _ms(dt: datetime.datetime) -> int:
+    """ datetime 转为毫秒时间戳 无时区的按 UTC 处理 """
+    if dt.tzinfo is not None:
+        return int(dt.timestamp() * 1000)
+    return (dt - EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def epoch_ms(value) -> int:
+    """ 日期转为毫秒时间戳 支持时间戳、ISO 格式与 JsonDecoder 的 '%Y-%m-%d %H:%M:%S'; 无时区的按 UTC 处理 """
+    if value is None or value == '':
+        return NAT
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        return _ms(value)
+    if value.isdigit():
+        return int(value)
+    return _ms(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+def _strptime_format(fmt: str):
+    """ java 日期格式转为 strptime 格式, 含不支持的字母时为 None """
+    ret = list()
+    for token in re.findall(r"[A-Za-z]+|'[^']*'|[^A-Za-z']+", fmt):
+        if token.startswith("'"):
+            ret.append(token[1:-1].replace('%', '%%'))
+        elif token[0].isalpha():
+            if token not in _JAVA_DATE:
+                return None
+            ret.append(_JAVA_DATE[token])
+        else:
+            ret.append(token.replace('%', '%%'))
+    return ''.join(ret)
+
+
+def date_parser(fmt: str = None):
+    """
+    按 DateField 的 format 生成解析函数 value -> 毫秒时间戳, 多个格式以 || 分隔, 依次尝试
+    支持 epoch_millis/epoch_second、内置的 ISO 格式(strict_date_optional_time 等)与 yyyy/MM/dd HH:mm:ss 形式的自定义格式;
+    含不支持的格式时返回 None
+    """
+    if not fmt:
+        return epoch_ms
+
+    parsers = list()
+    for f in fmt.split('||'):
+        if f == 'epoch_second':
+            parsers.append(lambda v: int(float(v) * 1000))
+        elif re.fullmatch('[a-z_]+', f) and not re.fullmatch('[yudHms]+', f):
+            # epoch_millis 与内置的 ISO 格式
+            parsers.append(epoch_ms)
+        else:
+            pattern = _strptime_format(f)
+            if pattern is None:
+                return None
+            parsers.append(lambda v, p=pattern: _ms(datetime.datetime.strptime(v, p)))
+
+    def parse(value) -> int:
+        if value is None or value == '':
+            return NAT
+        for parser in parsers:
+            try:
+                return parser(value)
+            except (ValueError, TypeError, AttributeError):
+                continue
+        raise ValueError(f'date {value!r} does not match format {fmt}')
+
+    return parse
+
+
+def field_types(properties: List[ESBaseField] = None) -> dict:
+    """ 字段名 -> es 类型 """
+    return {p.field_name: p.properties['type'] for p in properties or ()}
+
+
+def field_formats(properties: List[ESBaseField] = None) -> dict:
+    """ 日期字段名 -> format """
+    return {p.field_name: p.properties.get('format') for p in properties or ()
+            if p.properties['type'] == ESTypeMapping.Date}
+
+
+def _single(values: list, name: str = None) -> list:
+    """ 单元素的 list 展开为值, 空 list 为缺失; 多值字段无法放入一列, 抛出异常 """
+    ret = list()
+    for v in values:
+        if isinstance(v, list):
+            if len(v) > 1:
+                raise Exception(f'column need single-valued field({name}), got {v!r}')
+            v = v[0] if v else None
+        ret.append(v)
+    return ret
+
+
+def _objects(values: list):
+    if numpy is None:
+        return values
+    ret = numpy.empty(len(values), dtype=object)
+    ret[:] = values
+    return ret
+
+
+def column(values: list, es_type: str = None, date_format: str = None, name: str = None):
+    """
+    把一列原始值转为列数组
+    数值/布尔/日期: 有 numpy 时为 numpy 数组(日期为 datetime64[ms]), 否则为 array 模块数组(日期为毫秒时间戳);
+    缺失值: 浮点为 nan, 日期为 NaT; 整数列有缺失时为 float64 + nan, 布尔列有缺失时为 object 列(None)
+    日期按 date_format(DateField 的 format)解析, 格式不支持时为原始值的 object 列
+    多值字段(多个元素的 list)抛出异常, 单元素 list 按值处理
+    其它类型: 有 numpy 时为 object 数组, 否则为 list
+    """
+    if es_type not in TYPES:
+        return _objects(values)
+
+    values = _single(values, name)
+    dtype, typecode, missing = TYPES[es_type]
+    if es_type == ESTypeMapping.Date:
+        parse = date_parser(date_format)
+        if parse is None:
+            return _objects(values)
+        values = [parse(v) for v in values]
+        if numpy is None:
+            return array(typecode, values)
+        return numpy.array(values, dtype='int64').view(dtype)
+
+    if missing is None and None in values:
+        if es_type == ESTypeMapping.Boolean:
+            return _objects(values)
+        dtype, typecode, missing = NULLABLE
+    values = [missing if v is None else v for v in values]
+    if numpy is None:
+        return array(typecode, values)
+    return numpy.array(values, dtype=dtype)
+
+
+def concat(chunks: list, es_type: str = None):
+    """ 合并多页的列数组 整数/浮点、数值/object 混合时转为能容纳全部值的类型 """
+    if numpy is not None:
+        if not chunks:
+            return column([], es_type)
+        return chunks[0] if len(chunks) == 1 else numpy.concatenate(chunks)
+
+    if any(isinstance(c, list) for c in chunks):
+        ret = list()
+    else:
+        codes = {c.typecode for c in chunks}
+        ret = array(NULLABLE[1] if NULLABLE[1] in codes else TYPES[es_type][1]) if es_type in TYPES else list()
+    for chunk in chunks:
+        ret.extend(chunk if isinstance(ret, list) or chunk.typecode == ret.typecode else chunk.tolist())
+    return ret
+
+
+class ColumnBuilder(object):
+    """
+    逐页把 hit 解码为列 只保留列数组, 不为每条数据创建 dict
+    fields: 字段列表, 支持 _id 与 a.b 形式的嵌套字段
+    properties: es_fields 字段定义, 用于确定列类型与日期格式; 未定义的字段为 object 列
+    getter: 字段取值函数工厂 getter(field) -> fn(hit)
+    formats: 覆盖日期字段的格式 {字段: format}, 如 docvalue_fields 指定了 epoch_millis
+    """
+
+    def __init__(self, fields: List[str], properties: List[ESBaseField] = None, getter: Callable = None,
+                 formats: dict = None):
+        types, date_formats = field_types(properties), {**field_formats(properties), **(formats or {})}
+        self.fields = list(fields)
+        self.types = [types.get(f) for f in self.fields]
+        self.formats = [date_formats.get(f) for f in self.fields]
+        self.getters = [getter(f) for f in self.fields]
+        self.chunks = [list() for _ in self.fields]
+        self.rows = 0
+
+    def add(self, hits: list) -> "ColumnBuilder":
+        for field, chunks, getter, es_type, fmt in zip(self.fields, self.chunks, self.getters, self.types, self.formats):
+            chunks.append(column([getter(hit) for hit in hits], es_type, fmt, field))
+        self.rows += len(hits)
+        return self
+
+    def build(self) -> dict:
+        """ {字段: 列数组} """
+        return {f: concat(c, t) for f, c, t in zip(self.fields, self.chunks, self.types)}
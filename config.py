@@ -0,0 +1,110 @@
+import os
+
+from elasticsearch import Elasticsearch
+from elasticsearch.connection_pool import RoundRobinSelector
+
+
+def data_nodes_only(node_info: dict, host: dict):
+    """ 嗅探节点时只保留数据节点, 查询与写入不经过 master/协调节点 """
+    roles = node_info.get('roles', [])
+    if not any(role.startswith('data') for role in roles):
+        return None
+    return host
+
+
+class ESConfig(object):
+    """
+    es 连接配置 由 SimpleESClient.from_config 创建调优后的连接
+    usage:
+    # >>> config = ESConfig(['10.0.0.1', '10.0.0.2'], http_auth=('user', 'pwd'), threads=20, bulk_threads=8)
+    # >>> client = SimpleESClient.from_config(config)
+    # >>> client.pool_stats()
+    """
+
+    # 各类请求的超时时间(秒), 代替统一的 request_timeout=999
+    TIMEOUTS = {
+        'search': 30,
+        'msearch': 60,
+        'scroll': 120,
+        'bulk': 120,
+        'update_by_script': 3600,
+    }
+
+    def __init__(self,
+                 hosts: list,
+                 http_auth: tuple = None,
+                 port: int = None,
+                 threads: int = 10,
+                 bulk_threads: int = 5,
+                 maxsize: int = None,
+                 http_compress: str = 'bulk',
+                 sniff: bool = False,
+                 sniffer_timeout: float = 60,
+                 data_nodes: bool = True,
+                 timeout: float = 30,
+                 max_retries: int = 3,
+                 retry_on_timeout: bool = True,
+                 timeouts: dict = None,
+                 **transport):
+        """
+        threads: 并发发起查询的线程数, 查询连接池大小据此设置
+        bulk_threads: 并发批量写入的线程数, 即 bulk_insert 的 threads(adaptive 时最大并发为其 2 倍)
+        maxsize: 每个节点的连接池大小, 默认 threads + bulk_threads*2; http_compress='bulk' 时两个连接池分别按各自线程数设置
+        http_compress: True 压缩全部请求; 'bulk' 只压缩 bulk 请求(单独的连接池); False 不压缩
+        sniff: 启动时及连接失败时嗅探集群节点, 之后每 sniffer_timeout 秒刷新; 请求按节点轮询(RoundRobin)
+        data_nodes: 嗅探时只保留数据节点
+        timeout: 连接默认超时; timeouts: 各类请求的超时, 覆盖 TIMEOUTS 中的对应项
+        transport: 其它透传给 Elasticsearch 的参数
+        连接默认 keep-alive 复用, 连接池大小不小于并发线程数时不会反复新建连接
+        """
+        self.hosts = hosts
+        self.http_auth = http_auth
+        self.port = port
+        self.threads = threads
+        self.bulk_threads = bulk_threads
+        self.maxsize = maxsize
+        self.http_compress = http_compress
+        self.sniff = sniff
+        self.sniffer_timeout = sniffer_timeout
+        self.data_nodes = data_nodes
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_on_timeout = retry_on_timeout
+        self.timeouts = {**self.TIMEOUTS, **(timeouts or {})}
+        self.transport = transport
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "ESConfig":
+        """ 从环境变量 ES_HOST/ES_PORT/AUTHUSER/PASSWORD 读取连接信息 """
+        auth = os.environ.get('AUTHUSER') and (os.environ['AUTHUSER'], os.environ.get('PASSWORD', '')) or None
+        port = os.environ.get('ES_PORT') and int(os.environ['ES_PORT']) or None
+        return cls(os.environ['ES_HOST'].split(','), http_auth=auth, port=port, **kwargs)
+
+    def es_kwargs(self, bulk: bool = False) -> dict:
+        """ Elasticsearch 的构造参数 bulk=True 时为单独的 bulk 连接 """
+        split = self.http_compress == 'bulk'
+        if self.maxsize:
+            maxsize = self.maxsize
+        elif split:
+            maxsize = self.bulk_threads * 2 if bulk else self.threads
+        else:
+            maxsize = self.threads + self.bulk_threads * 2
+
+        kwargs = {
+            'maxsize': max(maxsize, 1),
+            'http_compress': bool(bulk if split else self.http_compress),
+            'timeout': self.timeout,
+            'max_retries': self.max_retries,
+            'retry_on_timeout': self.retry_on_timeout,
+            'selector_class': RoundRobinSelector,
+        }
+        self.http_auth and kwargs.update(http_auth=self.http_auth)
+        self.port and kwargs.update(port=self.port)
+        if self.sniff:
+            kwargs.update(sniff_on_start=True, sniff_on_connection_fail=True, sniffer_timeout=self.sniffer_timeout)
+            self.data_nodes and kwargs.update(host_info_callback=data_nodes_only)
+        kwargs.update(self.transport)
+        return kwargs
+
+    def create(self, bulk: bool = False) -> Elasticsearch:
+        return Elasticsearch(self.hosts, **self.es_kwargs(bulk))
@@ -0,0 +1,177 @@
+import datetime
+
+from typing import Iterable, List
+from helper import hit_source
+from es_fields import ESTypeMapping, ESBaseField
+
+_EMPTY = dict()
+_INT_TYPES = {ESTypeMapping.Long, ESTypeMapping.Integer, ESTypeMapping.Short, ESTypeMapping.Byte,
+              ESTypeMapping.UnsignedLong}
+_FLOAT_TYPES = {ESTypeMapping.Double, ESTypeMapping.Float, ESTypeMapping.HalfFloat, ESTypeMapping.ScaledFloat}
+
+
+def _each(fn):
+    """ 多值字段(list)逐个转换 """
+
+    def convert(value):
+        if isinstance(value, list):
+            return [None if v is None else fn(v) for v in value]
+        return fn(value)
+
+    return convert
+
+
+def _bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ('true', '1')
+    return bool(value)
+
+
+def _naive_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _date(value):
+    """ 毫秒时间戳、ISO 格式与 JsonDecoder 的 '%Y-%m-%d %H:%M:%S' 转为 datetime
+    统一为不带时区的 UTC 时间(同 columns.epoch_ms), 带时区的值先换算到 UTC
+    """
+    if isinstance(value, datetime.datetime):
+        return _naive_utc(value)
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, (int, float)) or value.isdigit():
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(value))
+    return _naive_utc(datetime.datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+# es 类型 -> (python 类型, 转换函数); 值的类型已经正确时不调用转换函数, python 类型为 None 时总是转换
+_CONVERTERS = {
+    **{t: (int, _each(int)) for t in _INT_TYPES},
+    **{t: (float, _each(float)) for t in _FLOAT_TYPES},
+    ESTypeMapping.Boolean: (bool, _each(_bool)),
+    # 带时区的 datetime 也需要换算
+    ESTypeMapping.Date: (None, _each(_date)),
+}
+
+
+def _convert_expr(field: ESBaseField, var: str, namespace: dict) -> str:
+    """ 生成字段转换表达式 """
+    converter = _CONVERTERS.get(field.properties['type'])
+    if converter is None:
+        return var
+
+    typ, fn = converter
+    namespace[f'_t_{field.field_name}'.replace('.', '_')] = typ
+    namespace[f'_c_{field.field_name}'.replace('.', '_')] = fn
+    name = field.field_name.replace('.', '_')
+    if typ is None:
+        return f'_c_{name}({var})'
+    return f'{var} if {var}.__class__ is _t_{name} else _c_{name}({var})'
+
+
+def _compile(cls, fields: dict):
+    """ 为模型生成 __init__/from_hit/to_source, 每个类一个函数, 避免逐字段动态分发 """
+    names = list(fields)
+    namespace = {'_EMPTY': _EMPTY, '_new': object.__new__, 'hit_source': hit_source}
+
+    init = [f'def __init__(self, _id=None, {", ".join(f"{n}=None" for n in names)}):', '    self._id = _id']
+    init += [f'    self.{n} = {n}' for n in names]
+
+    decode = ['def from_hit(cls, hit):', '    obj = _new(cls)', "    obj._id = hit.get('_id')",
+              "    src = hit_source(hit) if 'fields' in hit else hit.get('_source') or _EMPTY"]
+    for name, field in fields.items():
+        decode.append(f'    v = src.get({field.field_name!r})')
+        decode.append(f'    obj.{name} = None if v is None else {_convert_expr(field, "v", namespace)}')
+    decode.append('    return obj')
+
+    encode = ['def to_source(self):', '    src = {}']
+    for name, field in fields.items():
+        encode.append(f'    v = self.{name}')
+        encode.append(f'    if v is not None:')
+        encode.append(f'        src[{field.field_name!r}] = {_convert_expr(field, "v", namespace)}')
+    encode.append('    return src')
+
+    code = '\n'.join(init + [''] + decode + [''] + encode)
+    exec(compile(code, f'<document {cls.__name__}>', 'exec'), namespace)
+    return namespace['__init__'], namespace['from_hit'], namespace['to_source']
+
+
+class DocumentMeta(type):
+    def __new__(mcs, name, bases, attrs):
+        fields = dict()
+        for base in reversed(bases):
+            fields.update(getattr(base, '_fields', {}))
+
+        own = [k for k, v in attrs.items() if isinstance(v, ESBaseField)]
+        for key in own:
+            field = attrs.pop(key)
+            field.field_name = field.field_name or key
+            fields[key] = field
+
+        attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(own)
+        attrs['_fields'] = fields
+        cls = super().__new__(mcs, name, bases, attrs)
+        cls.__init__, from_hit, cls.to_source = _compile(cls, fields)
+        cls.from_hit = classmethod(from_hit)
+        return cls
+
+
+class Document(object, metaclass=DocumentMeta):
+    """
+    文档模型 以 es_fields 字段声明, 同时生成 mapping 与 __slots__ 实例
+    from_hit/to_source 按字段类型转换(如 IntegerField -> int, DateField -> datetime), 每个模型生成专用函数
+    from_hit(hit): 由 _search 返回的 hit 创建实例; to_source(): 转为写入的 _source, 忽略值为 None 的字段
+    usage:
+    # >>> class Person(Document):
+    # ...     index = 'person'
+    # ...     name = TextField()
+    # ...     age = IntegerField()
+    # ...     birth_day = DateField()
+    # >>> client.migrate({Person.index: Person.fields()})
+    # >>> people = client.search(index=Person.index, body=q()).documents(Person)
+    # >>> client.bulk_insert(index=Person.index, body=people)
+    """
+
+    __slots__ = ('_id',)
+    _fields = dict()
+    index = None
+
+    @classmethod
+    def fields(cls) -> List[ESBaseField]:
+        """ 字段定义列表 可用于 create_index/migrate 与 Result.to_columns """
+        return list(cls._fields.values())
+
+    @classmethod
+    def mapping(cls) -> dict:
+        properties = dict()
+        for field in cls._fields.values():
+            properties.update(field.get_field())
+        return {'mappings': {'properties': properties}}
+
+    @classmethod
+    def from_hits(cls, hits: Iterable[dict]) -> Iterable["Document"]:
+        return map(cls.from_hit, hits)
+
+    def to_dict(self) -> dict:
+        """ 带 _id 的 _source, 可直接用于 bulk_insert """
+        src = self.to_source()
+        self._id is not None and src.update(_id=self._id)
+        return src
+
+    def to_action(self, index: str = None, op_type: str = 'index') -> dict:
+        """ bulk 写入的 action """
+        action = self.to_source()
+        action.update(_op_type=op_type, _index=index or self.index)
+        self._id is not None and action.update(_id=self._id)
+        return action
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in ('_id',) + tuple(self._fields))
+
+    def __repr__(self):
+        values = ', '.join(f'{k}={getattr(self, k)!r}' for k in ('_id',) + tuple(self._fields))
+        return f'{type(self).__name__}({values})'
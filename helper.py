@@ -71,8 +71,17 @@ class JsonDecoder(json.JSONEncoder):
             return super().default(o)
 
 
-def json_dump(data):
-    return json.dumps(data, cls=JsonDecoder)
+def json_dump(data, **kwargs):
+    kwargs.setdefault('cls', JsonDecoder)
+    return json.dumps(data, **kwargs)
+
+
+def hit_source(hit: dict) -> dict:
+    """ hit 的 _source 合并 docvalue/stored 字段(fields), 单值字段展开为值 """
+    source = hit.get('_source') or {}
+    if 'fields' not in hit:
+        return source
+    return {**source, **{k: v[0] if isinstance(v, list) and len(v) == 1 else v for k, v in hit['fields'].items()}}
 
 
 class Result(object):
@@ -0,0 +1,327 @@
+import os
+import glob
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from bulk import BulkWriter, BulkReport
+
+# 队列中的控制消息
+_FLUSH = 'flush'
+_CLOSE = 'close'
+
+
+class _Signal(object):
+    __slots__ = ('kind', 'event')
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.event = threading.Event()
+
+
+class BufferedIndexer(object):
+    """
+    单条写入缓冲 insert/create/update/delete 立即返回, 后台线程按条数、字节数或时间间隔合并为 bulk 提交
+    队列满时调用方阻塞(put_timeout 秒后抛出 queue.Full, 该条数据未被接受); 进程退出时自动 flush
+    spill: 本地追加日志路径, 接受的数据先写入 {spill}.{n} 分段文件, 提交成功(或记入死信)后删除;
+    连接失败与 5xx 按 writer 的退避参数重试, 仍失败且没有 dead_letter 时保留该分段及之后的全部分段;
+    重启时未提交的分段自动重放, 语义为至少一次, 需要去重时请指定 _id
+    usage:
+    # >>> indexer = client.buffered_indexer(max_docs=1000, interval=1, spill='/data/es-spill')
+    # >>> indexer.insert(index='person', body={'name': 'xiaoming'})
+    # >>> indexer.update(index='person', id='1', data={'age': 12})
+    # >>> indexer.flush()  # 等待此前接受的数据全部提交
+    # >>> indexer.close()
+    """
+
+    def __init__(self,
+                 client,
+                 max_docs: int = 1000,
+                 max_bytes: int = 5 * 1024 * 1024,
+                 interval: float = 1.0,
+                 queue_size: int = 10000,
+                 put_timeout: float = None,
+                 threads: int = 2,
+                 spill: str = None,
+                 fsync: bool = False,
+                 segment_docs: int = 10000,
+                 dead_letter=None,
+                 max_failed: int = 1000,
+                 refresh: bool = False):
+        """
+        max_docs/max_bytes/interval: 缓冲达到条数、字节数或最早一条等待超过 interval 秒时提交
+        queue_size: 待处理队列长度上限, 满时 insert 等调用阻塞
+        put_timeout: 阻塞的最长时间(秒), 为空时一直等待
+        threads: 同时在途的 bulk 请求数
+        spill: 持久化文件路径前缀, 为空时不落盘; fsync: 每条都 fsync, 更可靠但更慢
+        segment_docs: 每个分段文件最多条数
+        dead_letter/max_failed: 同 SimpleESClient.bulk_insert
+        """
+        self.client = client
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.threads = max(threads, 1)
+        self.spill = spill
+        self.fsync = fsync
+        self.segment_docs = segment_docs
+        self.writer: BulkWriter = client._bulk_writer({
+            'limit': max_docs, 'max_chunk_bytes': max_bytes, 'threads': self.threads, 'refresh': refresh,
+            'adaptive': True,
+        })
+        self.report = BulkReport(dead_letter, max_failed)
+        self.accepted = 0
+        self.flushes = 0
+
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._acked = 0
+        # 有失败且未写入死信的数据时不再确认, 保留分段到下次重放
+        self._held = False
+        self._indices = set()
+        self._closed = False
+
+        self._segments_lock = threading.Lock()
+        self._segments = deque()
+        self._segment = 0
+        self._file = None
+        self._file_docs = 0
+        self._rotate = False
+
+        replay = self.spill and sorted(glob.glob(f'{glob.escape(self.spill)}.*'), key=self._segment_no) or []
+        self._segment = replay and self._segment_no(replay[-1]) + 1 or 0
+
+        self._thread = threading.Thread(target=self._run, name='BufferedIndexer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        replay and self._replay(replay)
+
+    @staticmethod
+    def _segment_no(path: str) -> int:
+        suffix = path.rsplit('.', 1)[-1]
+        return int(suffix) if suffix.isdigit() else -1
+
+    def _replay(self, paths: list):
+        """ 重放上次未提交的分段 重新写入新分段后删除旧文件 """
+        count = 0
+        for path in paths:
+            if self._segment_no(path) < 0:
+                continue
+            with open(path, encoding='utf-8') as f:
+                lines = [line.rstrip('\n') for line in f if line.strip()]
+
+            i = 0
+            while i < len(lines):
+                action = json.loads(lines[i])
+                if 'delete' in action or i + 1 >= len(lines):
+                    item, cur = (action,), lines[i:i + 1]
+                else:
+                    item, cur = (action, json.loads(lines[i + 1])), lines[i:i + 2]
+                i += len(cur)
+                self._put(item, cur, sum(len(line.encode('utf-8')) + 1 for line in cur))
+                count += 1
+            os.remove(path)
+        count and logging.info(f'BufferedIndexer replay {count} docs from {self.spill}')
+
+    def _write_spill(self, lines: list):
+        """ 追加到当前分段 调用方持有 _lock """
+        if self._file is not None and (self._rotate or self._file_docs >= self.segment_docs):
+            self._file.close()
+            with self._segments_lock:
+                self._segments.append((f'{self.spill}.{self._segment}', self._seq))
+                self._segment += 1
+            self._file, self._rotate = None, False
+            self._gc()
+
+        if self._file is None:
+            self._file = open(f'{self.spill}.{self._segment}', 'a', encoding='utf-8')
+            self._file_docs = 0
+
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+        self.fsync and os.fsync(self._file.fileno())
+        self._file_docs += 1
+
+    def _gc(self):
+        """ 删除已全部提交的分段 """
+        with self._segments_lock:
+            while self._segments and self._segments[0][1] <= self._acked:
+                path, _ = self._segments.popleft()
+                os.path.exists(path) and os.remove(path)
+
+    def _put(self, item: tuple, lines: list, size: int):
+        with self._lock:
+            if self._closed:
+                raise Exception('BufferedIndexer is closed')
+            # 先入队: 队列满抛出 queue.Full 时数据未被接受, 不写入分段也不计数
+            seq = self._seq + 1
+            self._queue.put((seq, item, lines, size), timeout=self.put_timeout)
+            self.spill and self._write_spill(lines)
+            self._seq = seq
+            self.accepted += 1
+
+    def add(self, action: dict):
+        """ 加入一条 bulk action, 如 {'_op_type': 'index', '_index': 'person', '_id': '1', ...} """
+        item, lines, size = self.writer.encode(action)
+        self._indices.add(action.get('_index'))
+        self._put(item, lines, size)
+
+    def insert(self, index: str, body: dict, id: str = None):
+        """ 插入数据 无ID时自动生成 """
+        action = {**body, '_op_type': 'index', '_index': index}
+        id is not None and action.update(_id=id)
+        self.add(action)
+
+    def create(self, index: str, id: str, body: dict):
+        """ 插入数据 ID已存在时失败 """
+        self.add({**body, '_op_type': 'create', '_index': index, '_id': id})
+
+    def update(self, index: str, id: str, data: dict, upsert: bool = False):
+        """ 局部更新 upsert=True 时文档不存在则插入 """
+        action = {'_op_type': 'update', '_index': index, '_id': id, 'doc': data}
+        upsert and action.update(doc_as_upsert=True)
+        self.add(action)
+
+    def delete(self, index: str, id: str):
+        self.add({'_op_type': 'delete', '_index': index, '_id': id})
+
+    @staticmethod
+    def _retryable(success: bool, info: dict) -> bool:
+        """ 连接失败(status 为 N/A)与 5xx 可重试 """
+        status = BulkWriter.status(info)
+        return not success and (not isinstance(status, int) or status >= 500)
+
+    def _send(self, bulk_data: list, lines: list) -> list:
+        with self.client._span('bulk', buffered=True) as span:
+            ret = self.writer.send(bulk_data, lines)
+            todo = [i for i, item in enumerate(ret) if self._retryable(*item)]
+            for attempt in range(self.writer.max_retries):
+                if not todo:
+                    break
+                time.sleep(min(self.writer.initial_backoff * 2 ** attempt, self.writer.max_backoff))
+                items = self.writer.send(*self.writer._select(bulk_data, lines, todo))
+                for i, item in zip(todo, items):
+                    ret[i] = item
+                todo = [i for i, item in zip(todo, items) if self._retryable(*item)]
+            span.set(docs=len(ret), failed=sum(1 for success, _ in ret if not success))
+        return ret
+
+    def _run(self):
+        """ 后台线程 合并队列中的数据并提交 最多 threads 个请求同时在途, 按提交顺序确认 """
+        bulk_data, lines, size, last_seq, deadline = list(), list(), 0, 0, None
+        pending = deque()
+
+        def ack(block: bool):
+            while pending and (block or pending[0][1].done()):
+                seq, future = pending.popleft()
+                try:
+                    ret = future.result()
+                except Exception as e:
+                    logging.error(f'BufferedIndexer bulk error: {e!r}')
+                    ret, failed = [], None
+                else:
+                    [self.report.add(success, info) for success, info in ret]
+                    failed = sum(1 for success, _ in ret if not success)
+                if failed is None or failed and not callable(self.report.dead_letter):
+                    # 未写入死信的失败数据只保存在分段中, 停止确认以免分段被删除
+                    self._held = True
+                    logging.error(f'BufferedIndexer bulk error: {failed} of {len(ret)} failed'
+                                  + (f', spill kept for replay: {self.spill}' if self.spill else ''))
+                elif failed:
+                    logging.error(f'BufferedIndexer bulk error: {failed} failed, written to dead letter')
+                if not self._held:
+                    self._acked = seq
+            self.spill and self._gc()
+            if self.spill and self._acked == self._seq:
+                self._rotate = True
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            while True:
+                timeout = deadline and max(deadline - time.monotonic(), 0)
+                if pending and (timeout is None or timeout > 0.05):
+                    # 有在途请求时定期醒来确认, 以便及时删除已提交的分段
+                    timeout = 0.05
+                try:
+                    msg = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    msg = None
+
+                signal = isinstance(msg, _Signal)
+                if msg is not None and not signal:
+                    seq, item, cur_lines, cur_size = msg
+                    bulk_data.append(item)
+                    lines.extend(cur_lines)
+                    size += cur_size
+                    last_seq = seq
+                    deadline = deadline or time.monotonic() + self.interval
+
+                full = len(bulk_data) >= self.max_docs or size >= self.max_bytes
+                if bulk_data and (msg is None or signal or full):
+                    while len(pending) >= self.threads:
+                        wait([pending[0][1]])
+                        ack(False)
+                    pending.append((last_seq, pool.submit(self._send, bulk_data, lines)))
+                    self.flushes += 1
+                    bulk_data, lines, size, deadline = list(), list(), 0, None
+                ack(False)
+
+                if not signal:
+                    continue
+                ack(True)
+                [self.client._invalidate(i) for i in list(self._indices) if i]
+                msg.event.set()
+                if msg.kind == _CLOSE:
+                    return
+
+    def _signal(self, kind: str, timeout: float = None) -> bool:
+        signal = _Signal(kind)
+        self._queue.put(signal)
+        return signal.event.wait(timeout)
+
+    def flush(self, timeout: float = None) -> bool:
+        """ 提交此前接受的全部数据并等待完成 超时返回 False """
+        return self._signal(_FLUSH, timeout)
+
+    def close(self, timeout: float = None):
+        """ 提交剩余数据并停止后台线程 全部提交后删除持久化文件 """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+
+        self._signal(_CLOSE, timeout)
+        self._thread.join(timeout)
+        self.report.finish(self.writer)
+        self.report.failed and logging.error(f'BufferedIndexer bulk error: {self.report.failed} failed, '
+                                             f'{self.report.dead_letters} dead letters')
+        self._file and self._file.close()
+        self._file = None
+        if self.spill and self._acked == self._seq:
+            with self._segments_lock:
+                self._segments.append((f'{self.spill}.{self._segment}', self._seq))
+            self._gc()
+
+    def stats(self) -> dict:
+        return {
+            'accepted': self.accepted,
+            'acked': self._acked,
+            'held': self._held,
+            'queued': self._queue.qsize(),
+            'flushes': self.flushes,
+            'success': self.report.success,
+            'failed': self.report.failed,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,203 @@
+import time
+import logging
+import threading
+import contextvars
+
+from typing import Callable, Iterable
+from collections import defaultdict
+from serializer import install
+
+_current = contextvars.ContextVar('es_orm_span', default=None)
+
+
+class Span(object):
+    """
+    一次客户端调用的埋点 结束时把 (op, labels, metrics) 发送给所有观察者
+    metrics 的时间单位为秒:
+        total: 调用总耗时
+        build: 开始到发出请求前, 参数整理/缓存键计算等
+        serialize/deserialize: 请求体 json 序列化/响应 json 解析耗时
+        network: 请求发出到收到响应, 扣除 serialize/deserialize 后的耗时
+        decode: 收到响应到调用结束, 如构造 Result
+        request_bytes/response_bytes: 请求体/响应体大小
+        took: es 返回的服务端耗时(毫秒); hits: 本次返回条数; total_hits: 匹配总数
+    """
+
+    __slots__ = ('instrument', 'op', 'labels', 'metrics', '_start', '_request', '_response', '_token')
+
+    def __init__(self, instrument: "Instrument", op: str, labels: dict):
+        self.instrument = instrument
+        self.op = op
+        self.labels = labels
+        self.metrics = dict()
+        self._request = self._response = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        _current.reset(self._token)
+        metrics = self.metrics
+        metrics['total'] = end - self._start
+        if self._request is not None and self._response is not None:
+            metrics['build'] = self._request - self._start
+            metrics['network'] = max(self._response - self._request - metrics.get('serialize', 0)
+                                     - metrics.get('deserialize', 0), 0)
+            metrics['decode'] = end - self._response
+        exc_type is not None and self.labels.update(error=exc_type.__name__)
+        self.instrument.emit(self.op, self.labels, metrics)
+
+    def request(self):
+        """ 标记开始发出请求 """
+        self._request = time.perf_counter()
+
+    def response(self, resp: dict = None):
+        """ 标记收到响应 记录 took 与命中数, 返回 resp """
+        self._response = time.perf_counter()
+        if isinstance(resp, dict):
+            resp.get('took') is not None and self.add('took', resp['took'])
+            hits = resp.get('hits')
+            if hits:
+                self.add('hits', len(hits.get('hits', ())))
+                total = hits.get('total')
+                self.add('total_hits', total.get('value', 0) if isinstance(total, dict) else total or 0)
+        return resp
+
+    def add(self, key: str, value):
+        self.metrics[key] = self.metrics.get(key, 0) + value
+
+    def set(self, **metrics):
+        self.metrics.update(metrics)
+
+
+class _NullSpan(object):
+    """ 未开启埋点时使用 所有操作为空 """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def request(self):
+        pass
+
+    def response(self, resp: dict = None):
+        return resp
+
+    def add(self, key: str, value):
+        pass
+
+    def set(self, **metrics):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class TimedSerializer(object):
+    """ 包装 es 连接的序列化器 把序列化/解析耗时与字节数记到当前 Span 上, 不在 Span 内时直接透传 """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.mimetype = serializer.mimetype
+
+    def dumps(self, data):
+        span = _current.get()
+        if span is None:
+            return self.serializer.dumps(data)
+
+        start = time.perf_counter()
+        ret = self.serializer.dumps(data)
+        span.add('serialize', time.perf_counter() - start)
+        span.add('request_bytes', len(ret))
+        return ret
+
+    def loads(self, s):
+        span = _current.get()
+        if span is None:
+            return self.serializer.loads(s)
+
+        start = time.perf_counter()
+        ret = self.serializer.loads(s)
+        span.add('deserialize', time.perf_counter() - start)
+        span.add('response_bytes', len(s))
+        return ret
+
+
+class Instrument(object):
+    """
+    客户端埋点 观察者为 callback(op, labels, metrics) 的可调用对象, 可在其中对接 Prometheus / OpenTelemetry
+    op: search/msearch/scroll/bulk 等; labels: 如 {'index': ...}; metrics: 见 Span
+    观察者抛出的异常只记录日志, 不影响调用
+    usage:
+    # >>> recorder = MetricsRecorder()
+    # >>> client = SimpleESClient(es, observers=[recorder])
+    # >>> recorder.snapshot()
+    """
+
+    def __init__(self, observers: Iterable[Callable] = ()):
+        self.observers = list(observers)
+
+    def attach(self, es):
+        """ 包装 es 连接的序列化器 统计序列化耗时与字节数 """
+        isinstance(es.transport.serializer, TimedSerializer) or install(es, TimedSerializer(es.transport.serializer))
+        return es
+
+    def span(self, op: str, labels: dict) -> Span:
+        return Span(self, op, labels)
+
+    def emit(self, op: str, labels: dict, metrics: dict):
+        for observer in self.observers:
+            try:
+                observer(op, labels, metrics)
+            except Exception as e:
+                logging.warning(f'metrics observer {observer!r} error: {e!r}')
+
+
+class MetricsRecorder(object):
+    """
+    内存聚合观察者 按 op 统计调用数、错误数以及每项指标的累计值与最大值
+    snapshot() 返回的扁平 dict 可直接导出为 Prometheus 指标
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.sums = defaultdict(lambda: defaultdict(float))
+        self.maxes = defaultdict(lambda: defaultdict(float))
+
+    def __call__(self, op: str, labels: dict, metrics: dict):
+        with self._lock:
+            self.calls[op] += 1
+            if 'error' in labels:
+                self.errors[op] += 1
+            sums, maxes = self.sums[op], self.maxes[op]
+            for key, value in metrics.items():
+                sums[key] += value
+                maxes[key] = max(maxes[key], value)
+
+    def snapshot(self) -> dict:
+        """ {'search_calls': 10, 'search_network_sum': 0.5, 'search_network_max': 0.1, ...} """
+        with self._lock:
+            ret = dict()
+            for op, calls in self.calls.items():
+                ret[f'{op}_calls'] = calls
+                ret[f'{op}_errors'] = self.errors[op]
+                for key, value in self.sums[op].items():
+                    ret[f'{op}_{key}_sum'] = value
+                    ret[f'{op}_{key}_max'] = self.maxes[op][key]
+            return ret
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.sums.clear()
+            self.maxes.clear()
@@ -0,0 +1,253 @@
+"""
+查询优化 在序列化前规范化 bool 查询, 匹配结果不变:
+1. 展开嵌套的 bool: must/filter 中不含 should 的 bool 提升到外层; must_not/should 中只含 should 的 bool 展开
+2. 合并同一字段的 term 为 terms: must_not 中总是合并; should 中在 minimum_should_match=1 且不计算相关性时合并
+3. must 中的常量评分查询(range/exists/terms 等)移到 filter, 不计算相关性时全部移到 filter, 以便 es 缓存
+4. 去掉重复条件: filter/must_not 中总是去重; must 中在不计算相关性时去重; should 中在不计算相关性且 minimum_should_match=1 时去重
+计算相关性时, 第 3 步只对必须匹配的 must 生效, 匹配文档的分数整体平移, 排序不变;
+设置 min_score 或聚合依赖分数(top_hits 等)时分数的数值会影响结果, 不做第 3 步
+"""
+import re
+
+OCCURS = ('must', 'filter', 'should', 'must_not')
+BOOL_KEYS = frozenset(OCCURS + ('minimum_should_match',))
+
+# 评分为常量的查询类型 放在 must 中对所有匹配文档贡献相同的分数
+CONSTANT_SCORE = {'range', 'exists', 'terms', 'wildcard', 'prefix', 'ids', 'constant_score'}
+
+# 结果依赖文档分数的聚合类型; 其它聚合中引用 _score(脚本、排序)时同样依赖
+SCORE_AGGS = {'top_hits', 'sampler', 'diversified_sampler'}
+_SCORE_REF = re.compile(r'\b_score\b')
+
+
+def _key(clause) -> str:
+    """ 条件的比较键 repr 相同的条件必然相同; 键顺序不同的相同条件不会被去重, 不影响正确性 """
+    return repr(clause)
+
+
+def _bool(clause):
+    """ 可以展开的 bool 即只含 must/filter/should/must_not/minimum_should_match 的 bool, 否则为 None """
+    body = isinstance(clause, dict) and len(clause) == 1 and clause.get('bool')
+    if isinstance(body, dict) and body.keys() <= BOOL_KEYS:
+        return body
+    return None
+
+
+def _msm(body: dict):
+    """ 生效的 minimum_should_match: 未设置时, 有 must/filter 为 0, 否则为 1 """
+    msm = body.get('minimum_should_match')
+    if msm is None:
+        return 0 if (body.get('must') or body.get('filter')) else 1
+    return int(msm) if str(msm).isdigit() else msm
+
+
+def _only(body: dict, occur: str) -> bool:
+    return bool(body.get(occur)) and not any(body.get(o) for o in OCCURS if o != occur)
+
+
+def _single(body: dict):
+    """ 只有一个 must/filter 条件的 bool 返回 (occur, 条件), 否则为 None """
+    clauses = [(o, c) for o in ('must', 'filter') for c in body.get(o) or ()]
+    if len(clauses) == 1 and not body.get('should') and not body.get('must_not'):
+        return clauses[0]
+    return None
+
+
+def _leaf_type(clause):
+    return isinstance(clause, dict) and len(clause) == 1 and next(iter(clause)) or None
+
+
+def _term_values(clause):
+    """ term/terms 查询返回 (字段, 值列表), 带 boost 等参数时为 None """
+    typ = _leaf_type(clause)
+    if typ not in ('term', 'terms') or not isinstance(clause[typ], dict) or len(clause[typ]) != 1:
+        return None
+
+    (field, value), = clause[typ].items()
+    if typ == 'terms':
+        return (field, list(value)) if isinstance(value, (list, tuple)) else None
+    if isinstance(value, dict):
+        return (field, [value['value']]) if list(value) == ['value'] else None
+    return field, [value]
+
+
+def merge_terms(clauses: list) -> list:
+    """ 合并同一字段的 term/terms 为一个 terms(或条件), 保持首次出现的位置 """
+    ret, fields = list(), dict()
+    for clause in clauses:
+        term = _term_values(clause)
+        if term is None:
+            ret.append(clause)
+            continue
+
+        field, values = term
+        if field in fields:
+            fields[field].extend(values)
+        else:
+            fields[field] = list(values)
+            ret.append(field)
+
+    for i, item in enumerate(ret):
+        if isinstance(item, str):
+            values = dedupe(fields[item])
+            ret[i] = {'term': {item: values[0]}} if len(values) == 1 else {'terms': {item: values}}
+    return ret
+
+
+def dedupe(clauses: list) -> list:
+    if len(clauses) < 2:
+        return clauses
+
+    seen, ret = set(), list()
+    for clause in clauses:
+        key = _key(clause)
+        if key not in seen:
+            seen.add(key)
+            ret.append(clause)
+    return ret
+
+
+def optimize_query(query: dict, scoring: bool = True, required: bool = True) -> dict:
+    """
+    优化单个查询 非 bool 查询原样返回
+    scoring: 是否需要相关性评分; required: 该查询是否在必须匹配的位置(顶层或 must 链上)
+    """
+    body = _bool(query)
+    if body is None:
+        return query
+
+    must, filter_, should, must_not = list(), list(), list(), list()
+    msm = _msm(body)
+
+    for clause in body.get('must') or ():
+        clause = optimize_query(clause, scoring, required)
+        inner = _bool(clause)
+        if inner is not None and not inner.get('should'):
+            must.extend(inner.get('must') or ())
+            filter_.extend(inner.get('filter') or ())
+            must_not.extend(inner.get('must_not') or ())
+        else:
+            must.append(clause)
+
+    for clause in body.get('filter') or ():
+        clause = optimize_query(clause, False)
+        inner = _bool(clause)
+        if inner is not None and not inner.get('should'):
+            filter_.extend(inner.get('must') or ())
+            filter_.extend(inner.get('filter') or ())
+            must_not.extend(inner.get('must_not') or ())
+        else:
+            filter_.append(clause)
+
+    for clause in body.get('must_not') or ():
+        clause = optimize_query(clause, False)
+        inner = _bool(clause)
+        if inner is not None and _only(inner, 'should') and _msm(inner) == 1:
+            must_not.extend(inner['should'])
+        elif inner is not None and _single(inner):
+            must_not.append(_single(inner)[1])
+        else:
+            must_not.append(clause)
+
+    for clause in body.get('should') or ():
+        clause = optimize_query(clause, scoring, False)
+        inner = _bool(clause)
+        single = inner is not None and _single(inner)
+        if inner is not None and msm == 1 and _only(inner, 'should') and _msm(inner) == 1:
+            should.extend(inner['should'])
+        elif single and (single[0] == 'must' or not scoring):
+            should.append(single[1])
+        else:
+            should.append(clause)
+
+    # 常量评分的 must 移到 filter
+    if not scoring or required:
+        moved = [c for c in must if not scoring or _leaf_type(c) in CONSTANT_SCORE]
+        must = [c for c in must if scoring and _leaf_type(c) not in CONSTANT_SCORE]
+        filter_.extend(moved)
+
+    filter_ = dedupe(filter_)
+    must_not = merge_terms(dedupe(must_not))
+    if not scoring:
+        must = dedupe(must)
+        if msm == 1:
+            # minimum_should_match>1 或百分比时重复条件计入匹配个数, 不能去重
+            should = merge_terms(dedupe(should))
+
+    ret = dict()
+    must and ret.update(must=must)
+    filter_ and ret.update(filter=filter_)
+    if should:
+        ret['should'] = should
+        ret['minimum_should_match'] = msm
+    must_not and ret.update(must_not=must_not)
+    return {'bool': ret}
+
+
+def unwrap(query: dict, scoring: bool = True) -> dict:
+    """ 只有一个条件的 bool 替换为该条件 """
+    body = _bool(query)
+    if body is None:
+        return query
+
+    single = _single(body)
+    if single and (single[0] == 'must' or not scoring):
+        return single[1]
+    if _only(body, 'should') and len(body['should']) == 1 and _msm(body) == 1:
+        return body['should'][0]
+    return query
+
+
+def _unwrap_children(query: dict, scoring: bool = True) -> dict:
+    body = _bool(query)
+    if body is None:
+        return query
+
+    ret = dict(body)
+    for occur in OCCURS:
+        if occur in body:
+            child_scoring = scoring and occur in ('must', 'should')
+            ret[occur] = [unwrap(_unwrap_children(c, child_scoring), child_scoring) for c in body[occur]]
+    return {'bool': ret}
+
+
+def score_aggs(aggs: dict) -> bool:
+    """ 聚合(含子聚合)是否依赖文档分数 """
+    for agg in (aggs or {}).values():
+        for typ, value in agg.items():
+            if typ in ('aggs', 'aggregations'):
+                if score_aggs(value):
+                    return True
+            elif typ in SCORE_AGGS or _SCORE_REF.search(repr(value)):
+                return True
+    return False
+
+
+def exact_scores(body: dict) -> bool:
+    """ 分数的数值(而不只是排序)影响结果: min_score 或依赖分数的聚合 """
+    return body.get('min_score') is not None or score_aggs(body.get('aggs') or body.get('aggregations'))
+
+
+def is_scoring(body: dict) -> bool:
+    """ 是否需要相关性评分: size=0 或按非 _score 字段排序时不需要; min_score/track_scores/依赖分数的聚合时总是需要 """
+    if body.get('track_scores') or exact_scores(body):
+        return True
+    if body.get('size') == 0:
+        return False
+
+    sort = body.get('sort')
+    if not sort:
+        return True
+    fields = [s if isinstance(s, str) else next(iter(s), None) for s in (sort if isinstance(sort, list) else [sort])]
+    return '_score' in fields
+
+
+def optimize(body: dict) -> dict:
+    """ 优化查询语句中的 query 返回新的 body, 顶层保持 bool 结构 """
+    if 'query' not in body:
+        return body
+
+    scoring = is_scoring(body)
+    # 分数数值影响结果时 must 不移到 filter
+    query = _unwrap_children(optimize_query(body['query'], scoring, not exact_scores(body)), scoring)
+    return {**body, 'query': query}
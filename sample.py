@@ -1,8 +1,8 @@
-import datetime, os, logging
+import datetime, logging
 import time
 
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
+from config import ESConfig
 from es_fields import TextField, IntegerField, DateField, ESObjectField
 from helper import rdm_str
 
@@ -30,21 +30,9 @@ indices = {
     ]
 }
 
-# 创建ES链接
-logging.info('-> create es connection')
-ES_INSTANCE = Elasticsearch(
-    [os.environ['ES_HOST']],
-    http_auth=[
-        os.environ['AUTHUSER'],
-        os.environ['PASSWORD']
-    ],
-    port=int(os.environ['ES_PORT']),
-    timeout=999, max_retries=3, retry_on_timeout=True
-)
-
-# 初始化ES客户端
-logging.info('-> init es client')
-client = SimpleESClient(ES_INSTANCE)
+# 创建ES链接 连接池大小、bulk 压缩与各类请求超时由 ESConfig 统一配置
+logging.info('-> create es client')
+client = SimpleESClient.from_config(ESConfig.from_env(threads=10, bulk_threads=5))
 
 # 初始化 index
 logging.info('-> init indices')
@@ -54,14 +42,17 @@ client.migrate(indices)
 logging.info('-> insert demo data')
 q = Q.filter('term', age=1)
 if not client.exists(index='person', body=q()):
-    for i in range(1, 101):
-        client.insert(index='person', body={
-            'age': i,
-            'sex': i % 2,
-            'name': (rdm_str(i) * 10)[:10],
-            'birth_day': datetime.datetime.now(),
-            'life': {'style': rdm_str(50)}
-        })
+    # 单条写入经缓冲合并为 bulk 提交, 退出 with 块时全部提交
+    with client.buffered_indexer(max_docs=500, interval=1) as indexer:
+        for i in range(1, 101):
+            indexer.insert(index='person', body={
+                'age': i,
+                'sex': i % 2,
+                'name': (rdm_str(i) * 10)[:10],
+                'birth_day': datetime.datetime.now(),
+                'life': {'style': rdm_str(50)}
+            })
+    client.es.indices.refresh(index='person')
 
 # 搜索 年龄等于1的人物信息
 q = Q.must('term', age=1)
@@ -1,3 +1,11 @@
+import re
+import hashlib
+
+from helper import JsonDecoder, json_dump, hit_source
+from optimizer import optimize as optimize_body
+from aggregations import Agg, Aggs, Terms, DateHistogram, Stats, Cardinality, Sum, Avg, Min, Max, Nested, Composite, \
+    parse_aggs
+from columns import ColumnBuilder
 from queries import BaseQuery, Should, Must, Filter, MustNot
 from conditions import Condition, Conditions, Term, Match, MatchAnd, Range, Exists, MatchPhrase, Wildcard
 
@@ -16,7 +24,7 @@ class Bool(object):
         ret = dict()
 
         for k, v in item().items():
-            ret.get(k) and ret[k].extend(v) or ret.update({k: v})
+            ret.setdefault(k, list()).extend(v)
 
         return ret
 
@@ -24,7 +32,8 @@ class Bool(object):
         ret = dict()
 
         for item in self.queries:
-            ret.update(self.parse_query(item))
+            for k, v in self.parse_query(item).items():
+                ret.setdefault(k, list()).extend(v)
         if 'should' in ret:
             ret['minimum_should_match'] = 1
         return {self.sen_name: ret}
@@ -42,6 +51,17 @@ class Sort(object):
         for key, val in kwargs.items():
             self.sorts.append(Condition({key: val}))
 
+    def fields(self):
+        """ 排序字段列表 """
+        return [key for item in self.sorts for key in item]
+
+    def with_tiebreaker(self, field='_id', order='asc'):
+        """ 返回追加了唯一决胜字段的新排序, search_after 翻页需要全局唯一的排序 """
+        sort = type(self)()
+        sort.sorts = list(self.sorts)
+        field not in self.fields() and sort.sorts.append(Condition({field: order}))
+        return sort
+
     def __call__(self, *args, **kwargs):
         return {self.sen_name: [item for item in self.sorts]}
 
@@ -61,20 +81,140 @@ class Collapse(object):
 
 
 class Update(object):
-    """ 脚本更新 """
+    """ 脚本更新
+    脚本按字段路径排序生成, 值全部通过 params 传入, 字段相同的更新共用同一段脚本, es 只需编译一次
+    a.b 形式的字段更新嵌套对象(中间对象不存在时创建); incr 为数值累加(字段不存在时从 0 开始)
+    store() 后引用存储脚本(id 由脚本内容生成), 由 SimpleESClient.update_by_script 通过 _scripts 注册一次
+    usage:
+    # >>> Update(name='xiaowang', **{'life.city': 'beijing'}).incr(age=1)
+    # >>> client.update_by_script(index='person', body=q(updater=Update(name='xiaowang').store()))
+    """
 
     lang = 'painless'
     sen_name = 'script'
+    id_prefix = 'simple-es-update-'
+    # 已生成的存储脚本 {id: source}
+    scripts = dict()
 
     def __init__(self, **params):
-        self.params = params
+        self.stored = False
+        self.params = dict()
+        self.ops = dict()
+        self.set(**params)
+
+    def _add(self, op: str, fields: dict) -> "Update":
+        for key, value in fields.items():
+            if key in self.ops and self.ops[key] != op:
+                raise Exception(f'Update need param({key}) only once')
+            self.ops[key] = op
+            self.params[key] = value
+        return self
+
+    def set(self, **fields) -> "Update":
+        """ 赋值 """
+        return self._add('set', fields)
+
+    def incr(self, **fields) -> "Update":
+        """ 累加 值为负数时递减 """
+        return self._add('incr', fields)
+
+    def store(self) -> "Update":
+        """ 使用存储脚本 """
+        self.stored = True
+        return self
+
+    @staticmethod
+    def _ref(var: str, key: str) -> str:
+        if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', key):
+            return f'{var}.{key}'
+        return f'{var}[{json_dump(key, ensure_ascii=False)}]'
+
+    @classmethod
+    def _statement(cls, op: str, key: str) -> str:
+        param = cls._ref('params', key)
+        path = key.split('.')
+        if len(path) == 1:
+            target = cls._ref('ctx._source', key)
+        else:
+            lines = ['m=ctx._source']
+            for name in path[:-1]:
+                ref = cls._ref('m', name)
+                lines.append(f'if({ref}==null){{{ref}=[:]}}m={ref}')
+            target = cls._ref('m', path[-1])
+            return ';'.join(lines + [cls._assign(op, target, param)])
+        return cls._assign(op, target, param)
+
+    @staticmethod
+    def _assign(op: str, target: str, param: str) -> str:
+        if op == 'incr':
+            return f'{target}=({target}==null?0:{target})+{param}'
+        return f'{target}={param}'
+
+    def source(self) -> str:
+        """ 规范化的脚本 只与字段路径和操作有关, 与值及参数顺序无关 """
+        keys = sorted(self.ops)
+        statements = [self._statement(self.ops[k], k) for k in keys]
+        if any('.' in k for k in keys):
+            statements.insert(0, 'def m')
+        return ';'.join(statements)
 
     def __call__(self, source=''):
-        for key in self.params:
-            source += f'{";" if source else ""}ctx._source.{key}=params.{key}'
+        own = self.source()
+        source = f'{source};{own}' if source and own else source or own
+        if self.stored:
+            script_id = self.id_prefix + hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+            self.scripts[script_id] = source
+            return {self.sen_name: {'id': script_id, 'params': self.params}}
         return {self.sen_name: {'source': source, 'params': self.params, 'lang': self.lang}}
 
 
+class Projection(object):
+    """ 字段投影 只返回需要的字段, 减少传输字节与 json 解码
+    includes/excludes: _source 中保留/去掉的字段(支持通配符), includes=False 时不返回 _source
+    docvalue_fields: 从列存(doc values)读取的字段, 不解析 _source, 适合数值/日期/keyword;
+        可为 {'field': 'birth_day', 'format': 'epoch_millis'}
+    stored_fields: mapping 中 store=true 的字段
+    Result 解码时 docvalue/stored 字段与 _source 合并, 单值字段展开为值
+    usage:
+    # >>> q = Q.filter('term', sex=1)(projection=Projection(['name'], docvalue_fields=['age']))
+    # >>> client.search(index='person', body=q, filter_path=True)
+    """
+
+    # filter_path=True 时只保留 Result 解码用到的部分
+    FILTER_PATH = (
+        'took', '_scroll_id', 'pit_id', 'hits.total', 'hits.hits._id', 'hits.hits._index', 'hits.hits._routing',
+        'hits.hits._source', 'hits.hits.fields', 'hits.hits.sort', 'aggregations',
+    )
+
+    def __init__(self, includes=None, excludes: list = None, docvalue_fields: list = None, stored_fields: list = None):
+        self.includes = includes
+        self.excludes = excludes
+        self.docvalue_fields = docvalue_fields
+        self.stored_fields = stored_fields
+
+    @classmethod
+    def filter_path(cls, value=True):
+        """ filter_path 参数 True 为 FILTER_PATH; 列表拼接为字符串; 为空时不过滤 """
+        if value is True:
+            value = cls.FILTER_PATH
+        if not value:
+            return None
+        return value if isinstance(value, str) else ','.join(value)
+
+    def __call__(self):
+        ret = dict()
+        if self.includes is False:
+            ret['_source'] = False
+        elif self.includes or self.excludes:
+            source = dict()
+            self.includes and source.update(includes=list(self.includes))
+            self.excludes and source.update(excludes=list(self.excludes))
+            ret['_source'] = source
+        self.docvalue_fields and ret.update(docvalue_fields=list(self.docvalue_fields))
+        self.stored_fields is not None and ret.update(stored_fields=list(self.stored_fields))
+        return ret
+
+
 class ESPagination(object):
     def __init__(self, page=1, page_size=20, limit=10000):
         self.page = page
@@ -92,6 +232,24 @@ class ESPagination(object):
         return {'size': self.page_size, 'from': from_}
 
 
+class SearchAfter(object):
+    """ search_after 翻页 不受 from+size<=10000 的限制
+    after 为上一页 Result.search_after() 返回的游标, 为空时查询第一页
+    需要与包含唯一决胜字段的 Sort 一起使用
+    """
+
+    sen_name = 'search_after'
+
+    def __init__(self, after: list = None, size=20):
+        self.after = after
+        self.size = size
+
+    def __call__(self):
+        ret = {'size': self.size}
+        self.after and ret.update({self.sen_name: list(self.after)})
+        return ret
+
+
 class Q(object):
     """
     usage:
@@ -111,6 +269,8 @@ class Q(object):
     # >>> updater = Update(field1='value1', field2='value2')
     # # 生成查询语句
     # >>> q(sort=sort, pagination=pagination, collapse=collapse, updater=updater)
+    # # 聚合
+    # >>> q(aggs=Aggs(Terms('city', 'city').sub(Stats('age', 'age'))))
     # 范围搜索
     # >>> query = Q.filter('range', pulled_at={'from': datetime.datetime.now() - datetime.timedelta(days=1)})
     """
@@ -144,13 +304,33 @@ class Q(object):
                  sort: Sort = None,
                  pagination: ESPagination = None,
                  collapse: Collapse = None,
-                 updater: Update = None):
+                 updater: Update = None,
+                 search_after: SearchAfter = None,
+                 aggs: Aggs = None,
+                 projection: Projection = None,
+                 optimize: bool = False):
+        """ optimize: 规范化并优化 bool 查询, 匹配结果不变, 见 optimizer
+        优化在客户端完成, 生成语句约慢 2.7 倍(bench_query: 约 6k/s vs 17k/s); 适合嵌套深、条件重复多的查询
+        """
         ret = {self.sen_name: Bool(*self.queries)()}
         callable(sort) and ret.update(sort())
         callable(updater) and ret.update(updater())
         callable(collapse) and ret.update(collapse())
         callable(pagination) and ret.update(pagination())
-        return ret
+        callable(search_after) and ret.update(search_after())
+        if isinstance(aggs, Agg):
+            aggs = Aggs(aggs)
+        callable(aggs) and ret.update(aggs())
+        callable(projection) and ret.update(projection())
+        return optimize_body(ret) if optimize else ret
+
+    def compile(self, **kwargs) -> "Template":
+        """ 编译为查询模板, 参数同 __call__; 条件值可使用 Param 占位
+        # >>> tpl = Q.filter('term', user_id=Param('uid')).compile(sort=Sort(age='desc'))
+        # >>> tpl.render(uid=1)       # dict
+        # >>> tpl.render_json(uid=1)  # json 字符串
+        """
+        return Template(self(**kwargs))
 
     @classmethod
     def common(cls, item_typ, query_typ, **kwargs) -> "Q":
@@ -174,11 +354,190 @@ class Q(object):
         return cls.common(item_typ, 'must_not', **kwargs)
 
 
+class Param(object):
+    """ 查询模板占位参数 """
+    __slots__ = ('name', 'default')
+    NO_DEFAULT = object()
+
+    def __init__(self, name: str, default=NO_DEFAULT):
+        self.name = name
+        self.default = default
+
+    @property
+    def marker(self):
+        return f'<<es_orm.Param:{self.name}>>'
+
+    def value(self, values: dict):
+        if self.name in values:
+            return values[self.name]
+        if self.default is self.NO_DEFAULT:
+            raise Exception(f'template need param({self.name})')
+        return self.default
+
+    def __repr__(self):
+        return f'Param({self.name!r})'
+
+
+class Template(object):
+    """ 编译后的查询模板
+    编译时只遍历一次查询树, 记录占位参数的位置;
+    render 只复制从根到占位参数所在路径上的容器, 其余子树与模板共享, 不要原地修改;
+    render_json 直接拼接预先序列化好的 json 片段
+    """
+
+    class _Encoder(JsonDecoder):
+        def default(self, o):
+            if isinstance(o, Param):
+                return o.marker
+            return super().default(o)
+
+    MARKER = re.compile(r'"<<es_orm\.Param:(.*?)>>"')
+
+    def __init__(self, body: dict):
+        self.body = body
+        self.params = dict()
+        self.plan = self._compile(body)
+        self.segments = self.MARKER.split(json_dump(body, cls=self._Encoder))
+
+    def _compile(self, node):
+        """ 返回占位参数的路径树 {key: 子树或 Param}, 无占位参数时返回 None """
+        if isinstance(node, Param):
+            self.params[node.name] = node
+            return node
+
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, (list, tuple)):
+            items = enumerate(node)
+        else:
+            return None
+
+        plan = dict()
+        for key, val in items:
+            sub = self._compile(val)
+            sub is not None and plan.update({key: sub})
+        return plan or None
+
+    def _render(self, node, plan: dict, values: dict):
+        node = dict(node) if isinstance(node, dict) else list(node)
+        for key, sub in plan.items():
+            if isinstance(sub, Param):
+                node[key] = sub.value(values)
+            else:
+                node[key] = self._render(node[key], sub, values)
+        return node
+
+    def render(self, **values) -> dict:
+        """ 代入参数 生成查询语句 """
+        if self.plan is None:
+            return dict(self.body)
+        return self._render(self.body, self.plan, values)
+
+    def render_json(self, **values) -> str:
+        """ 代入参数 生成序列化后的查询语句, 可直接作为 body 传给 SimpleESClient.search """
+        segments = list(self.segments)
+        for i in range(1, len(segments), 2):
+            segments[i] = json_dump(self.params[segments[i]].value(values))
+        return ''.join(segments)
+
+
+class Row(object):
+    """ 惰性只读行 原始 dict 的视图, 不复制数据
+    属性访问时才把嵌套对象包装为 Row; 下标/get/items 返回原始值, {**row} 可直接用于写入
+    # >>> row.life.style / row['life']['style'] / row.get('age')
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getattr__(self, item):
+        # 只有常规属性查找失败时才会进入
+        value = self._data.get(item)
+        if isinstance(value, dict):
+            row = Row.__new__(Row)
+            row._data = value
+            return row
+        return value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._data.values()
+
+    def items(self):
+        return self._data.items()
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class HitRow(Row):
+    """ 惰性结果行 _source 字段加 _id """
+    __slots__ = ('_id',)
+
+    def __init__(self, hit: dict):
+        super().__init__(hit_source(hit))
+        self._id = hit.get('_id')
+
+    def __getitem__(self, key):
+        return self._id if key == '_id' else super().__getitem__(key)
+
+    def get(self, key, default=None):
+        return self._id if key == '_id' else super().get(key, default)
+
+    def keys(self):
+        return ['_id', *self._data.keys()]
+
+    def items(self):
+        yield '_id', self._id
+        yield from self._data.items()
+
+    def to_dict(self) -> dict:
+        return {'_id': self._id, **self._data}
+
+    def __contains__(self, key):
+        return key == '_id' or key in self._data
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._data) + 1
+
+
 class Result(object):
     from conditions import Condition as Data
+    Row = HitRow
 
-    def __init__(self, result: dict):
+    def __init__(self, result: dict, lazy: bool = False):
+        """ lazy: 遍历时产出惰性的 Result.Row 而不是 Result.Data """
         self.result = result or {}
+        self.lazy = lazy
 
     def total(self):
         """数据总条数"""
@@ -192,16 +551,96 @@ class Result(object):
     def scroll_id(self):
         return self.result.get('_scroll_id', '')
 
+    @property
+    def error(self):
+        """ _msearch 中单个查询的错误信息, 成功时为 None """
+        return self.result.get('error')
+
+    @property
+    def pit_id(self):
+        return self.result.get('pit_id', '')
+
+    def aggs(self) -> dict:
+        """ 解析后的聚合结果 {聚合名: 分组列表/值/dict}, 见 aggregations.parse_agg """
+        return parse_aggs(self.result.get('aggregations'))
+
+    def after_key(self, name: str):
+        """ composite 聚合 name 的下一页游标, 没有更多分组时为 None """
+        return self.result.get('aggregations', {}).get(name, {}).get('after_key')
+
+    def search_after(self):
+        """ 下一页游标 即最后一条数据的 sort 值 """
+        hits = self.hits()
+        return hits and hits[-1].get('sort') or None
+
+    def rows(self):
+        """ 遍历结果 产出惰性的 Result.Row """
+        return map(self.Row, self.hits())
+
+    @staticmethod
+    def _getter(field: str):
+        if field == '_id':
+            return lambda hit: hit.get('_id')
+
+        def fields(hit):
+            """ docvalue/stored 字段 键为完整路径 """
+            value = hit.get('fields', {}).get(field)
+            return value[0] if isinstance(value, list) and len(value) == 1 else value
+
+        path = field.split('.')
+        if len(path) == 1:
+            def getter(hit):
+                value = (hit.get('_source') or {}).get(field)
+                return fields(hit) if value is None else value
+
+            return getter
+
+        def getter(hit):
+            """ _source 中没有的字段(如 docvalue_fields 投影)从 fields 中取, 同 hit_source """
+            value = hit.get('_source') or {}
+            for key in path:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                value = value.get(key)
+            return fields(hit) if value is None else value
+
+        return getter
+
+    def tuples(self, *fields: str):
+        """ 只投影指定字段 逐条产出 tuple, 支持 _id 与 a.b 形式的嵌套字段 """
+        getters = [self._getter(f) for f in fields]
+        for hit in self.hits():
+            yield tuple([g(hit) for g in getters])
+
+    def to_columns(self, fields: list, properties: list = None) -> dict:
+        """ 解码为列 {字段: 列数组}, 类型由 es_fields 定义 properties 确定, 见 columns.column
+        # >>> cols = result.to_columns(['_id', 'age', 'birth_day'], [IntegerField('age'), DateField('birth_day')])
+        # >>> numpy.nanmean(cols['age'])  # age 有缺失时为 float64, 缺失为 nan
+        """
+        return ColumnBuilder(fields, properties, self._getter).add(self.hits()).build()
+
+    def documents(self, model):
+        """ 解码为 document.Document 模型实例
+        # >>> people = list(result.documents(Person))
+        """
+        return map(model.from_hit, self.hits())
+
     def __iter__(self):
         """ 遍历结果 """
+        if self.lazy:
+            yield from self.rows()
+            return
+
         for item in self.hits():
-            yield self.Data(_id=item['_id'], **item['_source'])
+            yield self.Data(_id=item['_id'], **hit_source(item))
 
 
 __all__ = (
     'Condition', 'Conditions', 'Term', 'Match', 'MatchAnd', 'Range', 'Exists', 'MatchPhrase',
     'Wildcard', 'Should', 'Must', 'Filter', 'MustNot', 'Sort', 'Collapse', 'Update', 'ESPagination',
-    'Q', 'Result'
+    'SearchAfter', 'Q', 'Param', 'Template', 'Row', 'HitRow', 'Result', 'Agg', 'Aggs', 'Terms', 'DateHistogram',
+    'Stats', 'Cardinality', 'Sum', 'Avg', 'Min', 'Max', 'Nested', 'Composite', 'Projection'
 )
 # q = Q.filter('match_and', name='xiaoming')
 # q |= Q.must('match', age=12)
@@ -0,0 +1,61 @@
+import json
+
+from helper import JsonDecoder
+from elasticsearch import Elasticsearch
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.exceptions import SerializationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONSerializer(JSONSerializer):
+    """
+    快速 json 序列化 优先使用 orjson, 未安装时退化为标准库
+    date/datetime/time/timedelta/Decimal/UUID 的格式与 helper.JsonDecoder 一致,
+    注意 datetime 输出为 '%Y-%m-%d %H:%M:%S', DateField 需设置对应的 format
+    usage:
+    # >>> client = SimpleESClient(es, serializer=FastJSONSerializer())
+    """
+
+    def __init__(self):
+        self.decoder = JsonDecoder(ensure_ascii=False, separators=(',', ':'))
+        if orjson is not None:
+            self.option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def default(self, data):
+        try:
+            return self.decoder.default(data)
+        except TypeError:
+            return super().default(data)
+
+    def loads(self, s):
+        try:
+            if orjson is not None:
+                return orjson.loads(s)
+            return json.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+
+        try:
+            if orjson is not None:
+                return orjson.dumps(data, default=self.default, option=self.option).decode('utf-8')
+            return json.dumps(data, default=self.default, ensure_ascii=False, separators=(',', ':'))
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
+
+def install(es: Elasticsearch, serializer: JSONSerializer):
+    """ 替换 es 连接的序列化与反序列化器, 同时作用于查询 body 与 bulk NDJSON """
+    es.transport.serializer = serializer
+    deserializer = es.transport.deserializer
+    deserializer.serializers[serializer.mimetype] = serializer
+    if deserializer.default.mimetype == serializer.mimetype:
+        deserializer.default = serializer
+    return es
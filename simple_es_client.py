@@ -1,10 +1,28 @@
+import time
+import queue
 import logging
 import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import Callable, Dict
-from sentence import Result
-from helper import no_exception
-from elasticsearch import Elasticsearch, helpers
+from cache import QueryCache, SingleFlight
+from columns import ColumnBuilder
+from document import Document
+from indexer import BufferedIndexer
+from tasks import ESTask
+from config import ESConfig
+from serializer import install
+from metrics import Instrument, Span, NULL_SPAN
+from batch import SearchBatch, MSearchBatcher
+from helper import hit_source
+from es_fields import ESTypeMapping
+from sentence import Result, Sort, Aggs, Composite, Update, Projection
+from bulk import BulkWriter, AdaptiveBulkWriter, BulkReport, read_dead_letters
+from elasticsearch import Elasticsearch
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.exceptions import TransportError
 
 
 def params_check(fn: Callable = None, required: list = None, **defaults):
@@ -28,25 +46,196 @@ def params_check(fn: Callable = None, required: list = None, **defaults):
 
 
 class SimpleESClient(object):
-    def __init__(self, es: Elasticsearch):
+    # 未配置 timeouts 时各类请求的默认超时(秒)
+    REQUEST_TIMEOUT = 999
+
+    def __init__(self,
+                 es: Elasticsearch,
+                 cache: QueryCache = None,
+                 single_flight: SingleFlight = None,
+                 serializer: JSONSerializer = None,
+                 observers: list = None,
+                 bulk_es: Elasticsearch = None,
+                 timeouts: dict = None):
+        """
+        cache: 查询结果缓存, 为空时不缓存; 通过本客户端写入某个 index 时清除该 index 的缓存
+        single_flight: 合并并发的相同查询, 为空时不合并
+        serializer: 替换 es 连接的 json 序列化器, 如 serializer.FastJSONSerializer()
+        observers: 埋点观察者 callback(op, labels, metrics), 如 metrics.MetricsRecorder(); 为空时不埋点
+        bulk_es: 批量写入使用的连接, 为空时与 es 相同
+        timeouts: 各类请求的超时 {'search': 30, 'bulk': 120, ...}, 未配置的使用 REQUEST_TIMEOUT
+        """
         self.es: Elasticsearch = es
-
-    @params_check(required=['index', 'body'], request_timeout=999)
+        self.bulk_es: Elasticsearch = bulk_es or es
+        self.cache: QueryCache = cache
+        self.single_flight: SingleFlight = single_flight
+        self.batcher: MSearchBatcher = None
+        self.timeouts = dict(timeouts or {})
+        self.stored_scripts = set()
+        self.instrument: Instrument = observers and Instrument(observers) or None
+        for conn in self._connections():
+            serializer is not None and install(conn, serializer)
+            self.instrument is not None and self.instrument.attach(conn)
+
+    @classmethod
+    def from_config(cls, config: ESConfig, **kwargs) -> "SimpleESClient":
+        """ 按 ESConfig 创建调优后的连接与客户端, kwargs 同 __init__ """
+        es = config.create()
+        bulk_es = config.http_compress == 'bulk' and config.create(bulk=True) or None
+        return cls(es, bulk_es=bulk_es, timeouts=config.timeouts, **kwargs)
+
+    def _connections(self) -> list:
+        return [self.es] if self.bulk_es is self.es else [self.es, self.bulk_es]
+
+    def _timeout(self, op: str, value=None):
+        """ 请求超时 显式传入的 request_timeout 优先 """
+        return value or self.timeouts.get(op, self.REQUEST_TIMEOUT)
+
+    def pool_stats(self) -> list:
+        """ 各节点连接池使用情况
+        maxsize: 连接池大小; in_use: 正在使用的连接数; idle: 空闲的已建连接数
+        created: 累计新建连接数, 远大于 maxsize 说明连接池偏小, 连接被反复新建丢弃
+        requests: 累计请求数; dead: 被标记为不可用的节点数
+        """
+        ret = list()
+        for name, conn in zip(('es', 'bulk_es'), self._connections()):
+            connection_pool = conn.transport.connection_pool
+            dead = getattr(connection_pool, 'dead', None)
+            for connection in connection_pool.connections:
+                pool = getattr(connection, 'pool', None)
+                if pool is None:
+                    continue
+                idle = sum(1 for c in list(pool.pool.queue) if c is not None)
+                ret.append({
+                    'client': name,
+                    'host': connection.host,
+                    'maxsize': pool.pool.maxsize,
+                    'in_use': pool.pool.maxsize - pool.pool.qsize(),
+                    'idle': idle,
+                    'created': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'dead': dead.qsize() if dead is not None else 0,
+                })
+        return ret
+
+    def _invalidate(self, index: str):
+        self.cache is not None and self.cache.invalidate(index)
+
+    def _span(self, op: str, **labels) -> Span:
+        """ 埋点 未开启时返回空操作的 NULL_SPAN """
+        if self.instrument is None:
+            return NULL_SPAN
+        return self.instrument.span(op, labels)
+
+    @params_check(required=['index', 'body'], request_timeout=None, lazy=False, cache=True, batch=True,
+                  projection=None, filter_path=None)
     def search(self, **kwargs):
-        """搜索"""
+        """搜索
+        lazy=True 时遍历结果产出惰性的 Result.Row
+        cache=False 时跳过查询缓存
+        batch=False 时开启自动批量也单独提交
+        projection: sentence.Projection 字段投影, 合并到 body
+        filter_path: 响应过滤, True 时只保留 Result 用到的部分(Projection.FILTER_PATH); 自动批量提交时不生效
+        """
+        if kwargs['projection'] is not None:
+            kwargs['body'] = {**kwargs['body'], **kwargs['projection']()}
+
         params = {
             'body': kwargs['body'],
             'index': kwargs['index'],
-            'request_timeout': kwargs['request_timeout']
+            'request_timeout': self._timeout('search', kwargs['request_timeout'])
         }
 
         if kwargs.get('_source'):
             params['_source'] = kwargs['_source']
 
+        filter_path = Projection.filter_path(kwargs['filter_path'])
+        filter_path and params.update(filter_path=filter_path)
+
         if kwargs.get('doc_type'):
             params['doc_type'] = kwargs['doc_type']
 
-        return Result(self.es.search(**params))
+        use_cache = self.cache is not None and kwargs['cache']
+        use_batch = self.batcher is not None and kwargs['batch']
+        with self._span('search', index=kwargs['index']) as span:
+            if not (use_cache or use_batch or self.single_flight is not None):
+                span.request()
+                return Result(span.response(self.es.search(**params)), lazy=kwargs['lazy'])
+
+            key = QueryCache.make_key(kwargs['index'], kwargs['body'], [kwargs.get('_source'), filter_path])
+            resp = use_cache and self.cache.get(key)
+            if resp:
+                span.set(cache_hits=1)
+                return Result(resp, lazy=kwargs['lazy'])
+
+            generation = use_cache and self.cache.generation(kwargs['index']) or None
+
+            def fetch():
+                if use_batch:
+                    ret = self.batcher.search(**kwargs)
+                    if 'error' in ret:
+                        raise TransportError(ret.get('status', 'N/A'), ret['error'].get('type'), ret['error'])
+                else:
+                    ret = self.es.search(**params)
+                use_cache and self.cache.set(key, kwargs['index'], ret, generation)
+                return ret
+
+            span.request()
+            if self.single_flight is not None:
+                resp = self.single_flight.do(key, fetch)
+            else:
+                resp = fetch()
+            return Result(span.response(resp), lazy=kwargs['lazy'])
+
+    @params_check(required=['searches'], request_timeout=None, filter_path=None)
+    def msearch_raw(self, **kwargs):
+        """ 通过一次 _msearch 提交多个查询 按顺序返回原始响应
+        searches: [{'index': ..., 'body': ..., '_source': ...}]
+        单个查询出错时对应响应为 {'error': ..., 'status': ...}, 不影响其它查询
+        filter_path: 每个响应的过滤, 同 search
+        """
+        body = list()
+        for item in kwargs['searches']:
+            header = {'index': item['index']}
+            item.get('doc_type') and header.update(type=item['doc_type'])
+
+            search_body = item['body']
+            if item.get('_source'):
+                if not isinstance(search_body, dict):
+                    raise Exception('msearch need param(body) is dict when _source is set')
+                source = item['_source']
+                search_body = {**search_body, '_source': source.split(',') if isinstance(source, str) else source}
+            body.extend((header, search_body))
+
+        if not body:
+            return list()
+
+        with self._span('msearch', searches=len(kwargs['searches'])) as span:
+            span.request()
+            params = {'request_timeout': self._timeout('msearch', kwargs['request_timeout'])}
+            filter_path = Projection.filter_path(kwargs['filter_path'])
+            if filter_path:
+                paths = [f'responses.{p}' for p in filter_path.split(',')] + ['responses.error', 'responses.status']
+                params['filter_path'] = ','.join(paths)
+            responses = span.response(self.es.msearch(body=body, **params))
+            for resp in responses['responses']:
+                span.add('hits', len(resp.get('hits', {}).get('hits', ())))
+            return responses['responses']
+
+    @params_check(required=['searches'], request_timeout=None)
+    def msearch(self, **kwargs):
+        """ 批量查询 按顺序返回 Result 列表, 出错的查询可通过 Result.error 获取错误信息 """
+        responses = self.msearch_raw(**kwargs)
+        return [Result(r, lazy=s.get('lazy', False)) for s, r in zip(kwargs['searches'], responses)]
+
+    def batch(self, max_batch: int = 100) -> SearchBatch:
+        """ 显式批量查询 with 块结束时一次 _msearch 提交 """
+        return SearchBatch(self, max_batch=max_batch)
+
+    def auto_batch(self, window: float = 0.005, max_batch: int = 50) -> MSearchBatcher:
+        """ 开启自动批量: window 秒内并发发起的 search 合并为一次 _msearch; window=None 时关闭 """
+        self.batcher = window is not None and MSearchBatcher(self, window=window, max_batch=max_batch) or None
+        return self.batcher
 
     @params_check(required=['index', 'body'], refresh=False)
     def insert(self, **kwargs):
@@ -63,52 +252,439 @@ class SimpleESClient(object):
         if kwargs.get('id'):
             params['id'] = kwargs['id']
 
-        self.es.index(**params)
+        with self._span('insert', index=kwargs['index']) as span:
+            span.request()
+            span.response(self.es.index(**params))
+        self._invalidate(kwargs['index'])
 
-    @params_check(required=['index', 'body'], threads=5, refresh=False, limit=500)
+    def buffered_indexer(self, **kwargs) -> BufferedIndexer:
+        """ 单条写入缓冲 insert/update 等立即返回, 后台合并为 bulk 提交; 参数见 indexer.BufferedIndexer """
+        return BufferedIndexer(self, **kwargs)
+
+    def _bulk_writer(self, kwargs: dict) -> BulkWriter:
+        """ 按参数创建批量写入器 adaptive=True 时使用自适应批次大小与并发 """
+        params = {
+            'chunk_size': kwargs['limit'],
+            'max_chunk_bytes': kwargs['max_chunk_bytes'],
+            'threads': kwargs['threads'],
+            'refresh': kwargs['refresh'],
+            'request_timeout': self._timeout('bulk'),
+        }
+        if kwargs['adaptive']:
+            return AdaptiveBulkWriter(self.bulk_es, **params)
+        return BulkWriter(self.bulk_es, **params)
+
+    def _run_bulk(self, writer: BulkWriter, actions, report: BulkReport, progress=None, every=500) -> BulkReport:
+        """ 执行批量写入 结果记录到 report, 无法序列化的数据记为 invalid """
+        with self._span('bulk') as span:
+            for success, info in writer.run(actions, report.add_invalid):
+                report.add(success, info)
+                if callable(progress) and report.total % every == 0:
+                    progress(report.total, time.monotonic() - report._start)
+
+            report.finish(writer)
+            span.set(docs=report.total, failed=report.failed, rejected=report.rejected, retries=report.retries,
+                     batches=len(report.batches), docs_per_sec=report.docs_per_sec,
+                     batch_latency=sum(b.latency for b in report.batches))
+        report.failed and logging.error(f'bulk error: {report.failed} failed, {report.dead_letters} dead letters')
+        return report
+
+    @params_check(required=['index', 'body'], threads=5, refresh=False, limit=500, progress=None,
+                  max_chunk_bytes=100 * 1024 * 1024, adaptive=True, dead_letter=None, max_failed=1000)
     def bulk_insert(self, **kwargs):
-        """批量插入"""
-
-        @no_exception(default=None)
-        def get_action(data: dict):
-            return {
-                **data,
-                '_op_type': 'index',
-                '_index': kwargs['index'],
-            }
-
-        # 批量提交更新
-        actions = list(filter(None, [get_action(d) for d in kwargs['body'] if d]))
-        if actions:
-            act_num = len(actions)
-            chunk_size = act_num // kwargs['threads'] if act_num > kwargs['limit'] else act_num
-            for success, info in helpers.parallel_bulk(
-                    self.es,
-                    actions=actions,
-                    chunk_size=chunk_size,
-                    refresh=kwargs['refresh'],
-                    thread_count=kwargs['threads'],
-            ):
-                (not success) and logging.error(f'insert error: {info}')
-
-    @params_check(scroll='5m', size=200, limit=1000, required=['src', 'dst', 'filters'])
+        """批量插入
+        body 可以是 list 或生成器等任意可迭代对象, 流式按 limit 与 max_chunk_bytes 切分提交, 不会一次性加载全部数据
+        adaptive=True 时以 limit/threads 为起点, 根据批次耗时与 429 自动调整批次大小和并发
+        dead_letter: 失败数据写入的 jsonl 文件路径或回调, 可用 bulk_replay 重放
+        progress: 进度回调 progress(done, elapsed), 每完成 limit 条调用一次
+        返回 BulkReport
+        """
+        report = BulkReport(kwargs['dead_letter'], kwargs['max_failed'])
+
+        def actions():
+            for data in kwargs['body']:
+                if not data:
+                    continue
+                try:
+                    if isinstance(data, Document):
+                        action = data.to_action(kwargs['index'])
+                    else:
+                        action = {**data, '_op_type': 'index', '_index': kwargs['index']}
+                except Exception as e:
+                    report.add_invalid(data, e)
+                    continue
+                yield action
+
+        self._run_bulk(self._bulk_writer(kwargs), actions(), report, kwargs['progress'], kwargs['limit'])
+        self._invalidate(kwargs['index'])
+        return report
+
+    @params_check(required=['path'], threads=5, refresh=False, limit=500,
+                  max_chunk_bytes=100 * 1024 * 1024, adaptive=True, dead_letter=None, max_failed=1000)
+    def bulk_replay(self, **kwargs):
+        """ 重放死信文件 path 中的失败数据, 仍然失败的写入 dead_letter; 返回 BulkReport """
+        if kwargs['dead_letter'] == kwargs['path']:
+            raise Exception('bulk_replay need param(dead_letter) different from path')
+
+        report = BulkReport(kwargs['dead_letter'], kwargs['max_failed'])
+        indices = set()
+
+        def actions():
+            for action in read_dead_letters(kwargs['path']):
+                indices.add(action.get('_index'))
+                yield action
+
+        self._run_bulk(self._bulk_writer(kwargs), actions(), report)
+        [self._invalidate(i) for i in indices if i]
+        return report
+
+    @params_check(required=['index', 'body'], scroll='5m', size=1000, slice_id=None, slice_max=None,
+                  projection=None, filter_path=True)
+    def scroll(self, **kwargs):
+        """ scroll 逐页遍历 产出 Result; 遍历结束或中断时清理 scroll 上下文
+        slice_id/slice_max: sliced scroll 的分片编号与分片总数
+        projection: sentence.Projection 字段投影; filter_path: 同 search, 默认只保留 Result 用到的部分
+        """
+        body = dict(kwargs['body'])
+        body.pop('from', None)
+        kwargs['projection'] is not None and body.update(kwargs['projection']())
+        if kwargs['slice_max'] and kwargs['slice_max'] > 1:
+            body['slice'] = {'id': kwargs['slice_id'], 'max': kwargs['slice_max']}
+
+        params = {'scroll': kwargs['scroll'], 'request_timeout': self._timeout('scroll')}
+        filter_path = Projection.filter_path(kwargs['filter_path'])
+        filter_path and params.update(filter_path=filter_path)
+
+        with self._span('scroll', index=kwargs['index']) as span:
+            span.request()
+            data: Result = Result(span.response(self.es.search(
+                index=kwargs['index'],
+                size=kwargs['size'],
+                body=body,
+                **params,
+            )))
+        scroll_id = data.scroll_id
+        try:
+            while data.hits():
+                yield data
+                with self._span('scroll', index=kwargs['index']) as span:
+                    span.request()
+                    data = Result(span.response(self.es.scroll(scroll_id=scroll_id, **params)))
+                scroll_id = data.scroll_id or scroll_id
+        finally:
+            scroll_id and self.es.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+    @params_check(required=['index', 'body'], scroll='5m', size=1000, slices=1, queue_size=None,
+                  projection=None, filter_path=True)
+    def scan(self, **kwargs):
+        """ 遍历全部匹配数据 逐页产出 Result
+        slices>1 时使用 sliced scroll 多线程并行拉取, 页的顺序不保证
+        queue_size: 已拉取未消费的最大页数, 默认 slices*2
+        projection/filter_path: 同 scroll
+        """
+        if kwargs['slices'] <= 1:
+            yield from self.scroll(**kwargs)
+            return
+
+        slices = kwargs['slices']
+        pages = queue.Queue(maxsize=kwargs['queue_size'] or slices * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(slice_id):
+            try:
+                for page in self.scroll(**{**kwargs, 'slice_id': slice_id, 'slice_max': slices}):
+                    if not put(page):
+                        break
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(slices) as pool:
+            [pool.submit(worker, i) for i in range(slices)]
+            try:
+                finished = 0
+                while finished < slices:
+                    page = pages.get()
+                    if page is done:
+                        finished += 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield page
+            finally:
+                stop.set()
+
+    @params_check(required=['index', 'body', 'sort', 'tiebreaker'], size=1000, after=None, pit=False,
+                  keep_alive='1m', request_timeout=None)
+    def search_after_pages(self, **kwargs):
+        """ search_after 深度分页 逐页产出 Result, 不受 from+size<=10000 的限制
+        sort: Sort 排序, 会追加 tiebreaker 决胜字段保证翻页稳定
+        after: 起始游标 即上一页 Result.search_after()
+        pit: 是否使用 point in time 固定数据视图, 结束后自动关闭
+        tiebreaker: 必填的决胜字段, 需唯一且有 doc_values(如 keyword 类型的业务 ID); sort 中已包含时不重复追加
+        不提供默认值: _id 排序会把 _id fielddata 加载到堆内存; pit 隐式的 _shard_doc 需要 ES>=7.12,
+        7.10/7.11 上排序值相同的数据会在翻页时重复或遗漏; ES>=7.12 使用 pit 时可指定 tiebreaker='_shard_doc'
+        usage:
+        # >>> for page in client.search_after_pages(index='person', body=q(), sort=Sort(age='desc'), tiebreaker='uid'):
+        """
+        sort: Sort = kwargs['sort'].with_tiebreaker(kwargs['tiebreaker'])
+
+        body = dict(kwargs['body'])
+        body.pop('from', None)
+        body.update(sort())
+        body['size'] = kwargs['size']
+
+        params = {'request_timeout': self._timeout('search', kwargs['request_timeout'])}
+        if kwargs.get('_source'):
+            params['_source'] = kwargs['_source']
+
+        pit_id = None
+        if kwargs['pit']:
+            pit_id = self.es.open_point_in_time(index=kwargs['index'], keep_alive=kwargs['keep_alive'])['id']
+        else:
+            params['index'] = kwargs['index']
+
+        after = kwargs['after']
+        try:
+            while True:
+                after and body.update(search_after=after)
+                pit_id and body.update(pit={'id': pit_id, 'keep_alive': kwargs['keep_alive']})
+                with self._span('search_after', index=kwargs['index']) as span:
+                    span.request()
+                    data = Result(span.response(self.es.search(body=body, **params)))
+                if not data.hits():
+                    break
+
+                yield data
+                pit_id = data.pit_id or pit_id
+                after = data.search_after()
+                if len(data.hits()) < kwargs['size']:
+                    break
+        finally:
+            pit_id and self.es.close_point_in_time(body={'id': pit_id}, ignore=(404,))
+
+    def search_after(self, **kwargs):
+        """ search_after 深度分页 逐条产出 Result.Data, 参数同 search_after_pages """
+        for page in self.search_after_pages(**kwargs):
+            yield from page
+
+    @params_check(required=['index', 'body', 'fields'], properties=None, scroll='5m', size=1000, slices=1,
+                  docvalue=False)
+    def export_columns(self, **kwargs):
+        """ scroll 导出全部匹配数据的指定字段 逐页解码为列, 返回 {字段: 列数组}
+        fields: 字段列表, 只拉取这些字段的 _source
+        properties: es_fields 字段定义, 如 IntegerField -> int32(有缺失时 float64), DateField -> datetime64[ms]; 见 columns.column
+        docvalue=True 时从 doc values 读取字段(日期为毫秒时间戳), 不返回 _source; 字段需开启 doc_values(text 不支持)
+        slices>1 时并行拉取, 行的顺序不保证, 但各列的行一一对应
+        """
+        fields = [f for f in kwargs['fields'] if f != '_id']
+        formats = dict()
+        if kwargs['docvalue']:
+            dates = {p.field_name for p in kwargs['properties'] or () if p.properties['type'] == ESTypeMapping.Date}
+            docvalues = [{'field': f, 'format': 'epoch_millis'} if f in dates else f for f in fields]
+            projection = Projection(False, docvalue_fields=docvalues)
+            formats = {f: 'epoch_millis' for f in dates}
+        else:
+            projection = Projection(fields or False)
+
+        builder = ColumnBuilder(kwargs['fields'], kwargs['properties'], Result._getter, formats)
+        for page in self.scan(
+                index=kwargs['index'],
+                body=kwargs['body'],
+                size=kwargs['size'],
+                scroll=kwargs['scroll'],
+                slices=kwargs['slices'],
+                projection=projection,
+        ):
+            builder.add(page.hits())
+        return builder.build()
+
+    @params_check(required=['index', 'body', 'agg'], after=None, request_timeout=None)
+    def composite_pages(self, **kwargs):
+        """ composite 聚合按 after_key 逐页查询 产出 Result
+        body: 查询条件, 如 Q()(); 其中的 aggs/size 会被替换
+        agg: Composite 聚合, size 为每页分组数; after: 起始 after_key
+        """
+        agg: Composite = kwargs['agg']
+        body = {**kwargs['body'], 'size': 0}
+        after = kwargs['after']
+        while True:
+            body.update(Aggs(agg.after(after))())
+            data = self.search(index=kwargs['index'], body=body, request_timeout=kwargs['request_timeout'],
+                               cache=False, batch=False)
+            buckets = data.result.get('aggregations', {}).get(agg.name, {}).get('buckets', [])
+            if not buckets:
+                break
+
+            yield data
+            after = data.after_key(agg.name)
+            if after is None or len(buckets) < agg.params['size']:
+                break
+
+    def composite(self, **kwargs):
+        """ 流式遍历 composite 聚合的全部分组 逐个产出解析后的分组, 参数同 composite_pages
+        # >>> agg = Composite('by_city', [Terms('city', 'city'), DateHistogram('day', 'birth_day', '1d')], size=1000)
+        # >>> for bucket in client.composite(index='person', body=Q.filter('term', sex=1)(), agg=agg):
+        # ...     bucket['key']['city'], bucket['doc_count']
+        """
+        for page in self.composite_pages(**kwargs):
+            yield from page.aggs()[kwargs['agg'].name]
+
+    @params_check(scroll='5m', size=200, limit=1000, slices=1, threads=5, dead_letter=None, progress=None,
+                  projection=None, required=['src', 'dst', 'filters'])
     def reindex(self, **kwargs):
-        """数据迁移"""
-        data: Result = Result(self.es.search(
+        """数据迁移
+        slices>1 时 sliced scroll 并行读取, 所有分片共用一个流式批量写入
+        progress: 同 bulk_insert
+        projection: 只迁移投影的字段, 见 sentence.Projection
+        返回 BulkReport
+        """
+        pages = self.scan(
             index=kwargs['src'],
-            size=kwargs['size'],
             body=kwargs['filters'],
+            size=kwargs['size'],
             scroll=kwargs['scroll'],
-        ))
-
-        body = list()
-        while data.hits():
-            [body.append(s) for s in data]
-            if len(body) > kwargs['limit']:
-                self.bulk_insert(index=kwargs['dst'], body=body)
-                body = list()
-            data = Result(self.es.scroll(scroll_id=data.scroll_id, scroll=kwargs['scroll']))
-        body and self.bulk_insert(index=kwargs['dst'], body=body)
+            slices=kwargs['slices'],
+            projection=kwargs['projection'],
+        )
+        return self.bulk_insert(
+            index=kwargs['dst'],
+            body=({'_id': hit['_id'], **hit_source(hit)} for page in pages for hit in page.hits()),
+            limit=kwargs['limit'],
+            threads=kwargs['threads'],
+            dead_letter=kwargs['dead_letter'],
+            progress=kwargs['progress'],
+        )
+
+    def _reindex_server(self, src: list, dst: str, query: dict, size: int, slices, progress, poll: float) -> int:
+        """ 服务端 _reindex 后台任务 轮询进度直到完成, 返回写入条数 """
+        source = {'index': src, 'size': size}
+        query and source.update(query=query)
+        resp = self.es.reindex(body={'source': source, 'dest': {'index': dst}}, slices=slices,
+                               wait_for_completion=False, refresh=False)
+
+        summary = ESTask(self.es, resp['task'], 'reindex').wait(poll=poll, progress=progress)
+        if summary['error'] or summary['failures']:
+            raise Exception(f'reindex {src} -> {dst} failed: {summary["error"] or summary["failures"][:3]}')
+        return summary['created'] + summary['updated']
+
+    @params_check(required=['alias', 'properties'], filters=None, server=True, slices='auto', threads=5, limit=1000,
+                  size=1000, scroll='5m', version=None, max_num_segments=1, replicas=None, delete_old=False,
+                  progress=None, poll=5, block_writes=True)
+    def rebuild_index(self, **kwargs):
+        """ 按新的字段定义重建 alias 指向的 index, 读不停机, 复制期间暂停写入
+        1. 创建 {alias}_{version} 新 index, 写入期间 refresh_interval=-1, number_of_replicas=0
+        2. 旧 index 设为只读(index.blocks.write)并刷新; server=True 时服务端 _reindex(slices='auto' 按分片并行),
+           否则客户端 sliced scroll + 并行批量写入
+        3. 恢复 refresh_interval 与副本数(默认与旧 index 相同, replicas 指定新的副本数), 刷新并 force merge
+        4. 原子地把 alias 从旧 index 切换到新 index, delete_old=True 时同一请求中删除旧 index; 之后(或失败时)解除旧 index 只读
+        复制期间写入 alias 会返回 403 cluster_block_exception, 调用方需暂停写入或稍后重试;
+        block_writes=False 时不加只读, 复制开始后写入旧 index 的数据在切换后丢失, 仅用于已停止写入的场景
+        properties: es_fields 字段定义列表; filters: 只迁移匹配的数据 {'query': ...}
+        version: 新 index 后缀, 默认当前时间; max_num_segments: force merge 段数, 为空时不合并
+        progress: 进度回调 progress(done, elapsed), 各步骤的耗时与写入速度同时记录到日志
+        返回 {'index', 'source', 'docs', 'docs_per_sec', 'seconds': {步骤: 耗时}}
+        usage:
+        # >>> client.rebuild_index(alias='person', properties=Person.fields(), progress=print)
+        """
+        alias = kwargs['alias']
+        if self.es.indices.exists(alias) and not self.es.indices.exists_alias(name=alias):
+            raise Exception(f'rebuild_index need param(alias) {alias} is an index, not an alias')
+
+        src = list(self.es.indices.get_alias(name=alias)) if self.es.indices.exists_alias(name=alias) else []
+        dst = f'{alias}_{kwargs["version"] or time.strftime("%Y%m%d%H%M%S")}'
+        if dst in src or self.es.indices.exists(dst):
+            raise Exception(f'rebuild_index need param(version) {dst} already exists')
+
+        old = src and self.es.indices.get_settings(index=src[0], name='index.number_of_replicas,index.refresh_interval')
+        old = old and next(iter(old.values()))['settings']['index'] or {}
+        # 已经只读的旧 index 结束后保持只读
+        blocked = src and self.es.indices.get_settings(index=','.join(src), name='index.blocks.write') or {}
+        blocked = {i for i, v in blocked.items()
+                   if str(v['settings'].get('index', {}).get('blocks', {}).get('write')).lower() == 'true'}
+        unblock = [i for i in src if i not in blocked] if kwargs['block_writes'] else []
+        replicas = kwargs['replicas'] if kwargs['replicas'] is not None else int(old.get('number_of_replicas', 1))
+
+        seconds, start = dict(), time.monotonic()
+
+        def step(name: str, begin: float):
+            seconds[name] = round(time.monotonic() - begin, 3)
+            logging.info(f'rebuild_index {alias} -> {dst}: {name} {seconds[name]}s')
+            return time.monotonic()
+
+        with self._span('rebuild_index', index=alias) as span:
+            now = time.monotonic()
+            self.create_index(dst, kwargs['properties'], settings={'refresh_interval': '-1', 'number_of_replicas': 0})
+            now = step('create', now)
+
+            if unblock:
+                self.es.indices.put_settings(index=','.join(unblock), body={'index.blocks.write': True})
+                # 只读前已确认的写入需刷新后才能被复制
+                self.es.indices.refresh(index=','.join(src))
+            swapped = False
+            try:
+                docs = 0
+                if src and kwargs['server']:
+                    docs = self._reindex_server(src, dst, (kwargs['filters'] or {}).get('query'), kwargs['size'],
+                                                kwargs['slices'], kwargs['progress'], kwargs['poll'])
+                elif src:
+                    slices = kwargs['slices'] if isinstance(kwargs['slices'], int) else kwargs['threads']
+                    report = self.reindex(src=','.join(src), dst=dst, filters=kwargs['filters'] or {},
+                                          size=kwargs['size'], scroll=kwargs['scroll'], slices=slices,
+                                          limit=kwargs['limit'], threads=kwargs['threads'], progress=kwargs['progress'])
+                    if report.failed:
+                        raise Exception(
+                            f'rebuild_index {dst} failed: {report.failed} docs not written, alias not switched')
+                    docs = report.success
+                copy_seconds = time.monotonic() - now
+                now = step('copy', now)
+                logging.info(f'rebuild_index {alias} -> {dst}: {docs} docs, {docs / max(copy_seconds, 1e-9):.0f} docs/s')
+
+                self.es.indices.put_settings(index=dst, body={'index': {
+                    'refresh_interval': old.get('refresh_interval'),
+                    'number_of_replicas': replicas,
+                }})
+                self.es.indices.refresh(index=dst)
+                now = step('settings', now)
+
+                if kwargs['max_num_segments']:
+                    self.es.indices.forcemerge(index=dst, max_num_segments=kwargs['max_num_segments'],
+                                               request_timeout=self._timeout('update_by_script'))
+                    now = step('forcemerge', now)
+
+                actions = [{'remove': {'index': i, 'alias': alias}} for i in src]
+                actions.append({'add': {'index': dst, 'alias': alias, 'is_write_index': True}})
+                kwargs['delete_old'] and actions.extend({'remove_index': {'index': i}} for i in src)
+                self.es.indices.update_aliases(body={'actions': actions})
+                step('swap', now)
+                swapped = True
+            finally:
+                # delete_old 时旧 index 已删除
+                restore = [] if swapped and kwargs['delete_old'] else unblock
+                restore and self.es.indices.put_settings(index=','.join(restore), body={'index.blocks.write': None})
+
+            total = time.monotonic() - start
+            span.set(docs=docs, docs_per_sec=docs / max(copy_seconds, 1e-9))
+
+        [self._invalidate(i) for i in src + [dst, alias]]
+        return {
+            'index': dst,
+            'source': src,
+            'docs': docs,
+            'docs_per_sec': round(docs / max(copy_seconds, 1e-9), 1),
+            'seconds': {**seconds, 'total': round(total, 3)},
+        }
 
     @params_check(refresh=False, required=['id', 'index', 'body'])
     def create(self, **kwargs):
@@ -123,51 +699,90 @@ class SimpleESClient(object):
         if kwargs.get('doc_type'):
             params['doc_type'] = kwargs['doc_type']
 
-        self.es.create(**params)
+        with self._span('create', index=kwargs['index']) as span:
+            span.request()
+            span.response(self.es.create(**params))
+        self._invalidate(kwargs['index'])
 
-    @params_check(threads=5, refresh=False, limit=500, required=['data', 'index', 'body'])
+    @params_check(threads=5, refresh=False, limit=500, size=1000, slices=1, scroll='5m', progress=None,
+                  max_chunk_bytes=100 * 1024 * 1024, adaptive=True, dead_letter=None, max_failed=1000,
+                  required=['data', 'index', 'body'])
     def update_by_query(self, **kwargs):
-        """ 根据查询更新 """
+        """ 根据查询更新全部匹配数据
+        scroll(slices>1 时 sliced scroll) 只拉取 _id/_index, 流式提交到并行批量写入, 内存占用与数据量无关
+        size: scroll 每页条数; limit: 每批(初始)更新条数; threads: 并发批次数; adaptive: 同 bulk_insert
+        progress: 进度回调 progress(done, elapsed), 每完成 limit 条调用一次
+        dead_letter/max_failed: 同 bulk_insert
+        返回 BulkReport
+        """
         if not isinstance(kwargs['data'], dict):
             raise Exception('update_by_query need param(data) is dict')
 
-        @no_exception(default=None)
-        def get_action(data):
-            return {
-                '_id': data['_id'],
-                '_op_type': 'update',
-                '_index': data['_index'],
-                'doc': kwargs['data'],
-            }
-
-        result: Result = self.search(_source='_id,_index', **kwargs)
-        actions = list(filter(None, [get_action(d) for d in result.hits() if d]))
-        if actions:
-            act_num = len(actions)
-            chunk_size = act_num // kwargs['threads'] if act_num > kwargs['limit'] else act_num
-            for success, info in helpers.parallel_bulk(
-                    self.es,
-                    actions=actions,
-                    chunk_size=chunk_size,
-                    refresh=kwargs['refresh'],
-                    thread_count=kwargs['threads'],
-            ):
-                (not success) and logging.error(f'insert error: {info}')
-
-    @params_check(required=['body', 'index'], refresh=False, request_timeout=999)
+        body = dict(kwargs['body'])
+        body.pop('size', None)
+        body.update({'_source': False, 'stored_fields': []})
+        pages = self.scan(
+            index=kwargs['index'],
+            body=body,
+            size=kwargs['size'],
+            scroll=kwargs['scroll'],
+            slices=kwargs['slices'],
+        )
+        actions = ({
+            '_id': hit['_id'],
+            '_op_type': 'update',
+            '_index': hit['_index'],
+            'doc': kwargs['data'],
+        } for page in pages for hit in page.hits())
+
+        report = BulkReport(kwargs['dead_letter'], kwargs['max_failed'])
+        self._run_bulk(self._bulk_writer(kwargs), actions, report, kwargs['progress'], kwargs['limit'])
+        logging.info(f'update_by_query {kwargs["index"]}: {report.total} docs, {report.docs_per_sec:.0f} docs/s')
+        self._invalidate(kwargs['index'])
+        return report
+
+    @params_check(required=['body', 'index'], refresh=False, request_timeout=None, wait_for_completion=True,
+                  slices='auto', requests_per_second=None, conflicts=None)
     def update_by_script(self, **kwargs):
-        """ 当数据量大时，比较慢 """
+        """ 按脚本更新匹配数据(服务端 _update_by_query)
+        slices: 并行切片数, 'auto' 按分片数并行; requests_per_second: 每秒处理条数上限(限速), 为空时不限
+        conflicts: 'proceed' 时版本冲突的数据跳过而不是中止
+        wait_for_completion=False 时作为后台任务执行, 立即返回 tasks.ESTask, 可查询进度、限速与取消,
+        不再占用客户端线程; 否则阻塞到完成, 返回执行结果
+        """
         if not (kwargs['body'].get('script') and isinstance(kwargs['body']['script'], dict)):
             raise Exception('update_by_script need param(body.script) is dict')
+        self.put_script(kwargs['body']['script'].get('id'))
 
         params = {
             'body': kwargs['body'],
             'index': kwargs['index'],
             'refresh': kwargs['refresh'],
-            'request_timeout': kwargs['request_timeout']
+            'slices': kwargs['slices'],
+            'wait_for_completion': kwargs['wait_for_completion'],
         }
-
-        self.es.update_by_query(**params)
+        kwargs['requests_per_second'] and params.update(requests_per_second=kwargs['requests_per_second'])
+        kwargs['conflicts'] and params.update(conflicts=kwargs['conflicts'])
+
+        with self._span('update_by_script', index=kwargs['index'], wait=kwargs['wait_for_completion']) as span:
+            if not kwargs['wait_for_completion']:
+                span.request()
+                resp = span.response(self.es.update_by_query(request_timeout=self._timeout('search'), **params))
+                return ESTask(self.es, resp['task'], 'update_by_query', lambda _: self._invalidate(kwargs['index']))
+
+            params['request_timeout'] = self._timeout('update_by_script', kwargs['request_timeout'])
+            span.request()
+            resp = span.response(self.es.update_by_query(**params))
+            span.set(updated=resp.get('updated', 0))
+        self._invalidate(kwargs['index'])
+        return resp
+
+    def put_script(self, script_id: str):
+        """ 注册 sentence.Update 生成的存储脚本 每个 id 只注册一次 """
+        if not script_id or script_id in self.stored_scripts or script_id not in Update.scripts:
+            return
+        self.es.put_script(id=script_id, body={'script': {'lang': Update.lang, 'source': Update.scripts[script_id]}})
+        self.stored_scripts.add(script_id)
 
     @params_check(required=['body', 'index'])
     def exists(self, **kwargs):
@@ -179,14 +794,16 @@ class SimpleESClient(object):
         """删除index"""
         if self.es.indices.exists(index):
             self.es.indices.delete(index)
+        self._invalidate(index)
 
-    def create_index(self, index: str, properties: list):
-        """创建index"""
+    def create_index(self, index: str, properties: list, settings: dict = None):
+        """创建index settings: index 设置, 如 {'number_of_shards': 3}"""
         if not self.es.indices.exists(index):
             mappings = {'mappings': {'properties': dict()}}
             properties_ = mappings['mappings']['properties']
             for item in properties:
                 properties_.update(item.get_field())
+            settings and mappings.update(settings={'index': settings})
             self.es.indices.create(index=index, body=mappings)
 
     def add_alias(self, index: str, alias: str, is_write_index=True):
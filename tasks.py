@@ -0,0 +1,133 @@
+import time
+import asyncio
+import logging
+
+# 任务状态中的计数字段
+COUNTERS = ('total', 'created', 'updated', 'deleted', 'noops', 'version_conflicts', 'batches')
+
+# 任务类型 -> rethrottle 接口名
+RETHROTTLE = {
+    'update_by_query': 'update_by_query_rethrottle',
+    'delete_by_query': 'delete_by_query_rethrottle',
+    'reindex': 'reindex_rethrottle',
+}
+
+
+def summarize(task_id: str, ret: dict) -> dict:
+    """ 把 _tasks 的返回整理为进度/结果摘要 """
+    task = ret.get('task', {})
+    status = ret.get('response') or task.get('status', {})
+    summary = {k: status.get(k, 0) for k in COUNTERS}
+    done = summary['created'] + summary['updated'] + summary['deleted'] + summary['noops']
+    seconds = task.get('running_time_in_nanos', 0) / 1e9 or status.get('took', 0) / 1000
+    summary.update({
+        'task': task_id,
+        'completed': bool(ret.get('completed')),
+        'cancelled': bool(task.get('cancelled')) or status.get('canceled') is not None,
+        'done': done,
+        'seconds': round(seconds, 3),
+        'docs_per_sec': round(done / seconds, 1) if seconds else 0,
+        'requests_per_second': status.get('requests_per_second'),
+        'failures': status.get('failures', []),
+        'error': ret.get('error'),
+    })
+    return summary
+
+
+class ESTask(object):
+    """
+    服务端后台任务(update_by_query/reindex/delete_by_query, wait_for_completion=false)的句柄
+    usage:
+    # >>> task = client.update_by_script(index='person', body=q(updater=Update(age=1)), wait_for_completion=False)
+    # >>> task.status()              # {'total': ..., 'updated': ..., 'docs_per_sec': ...}
+    # >>> task.rethrottle(500)       # 调整每秒处理条数, -1 为不限
+    # >>> task.wait(progress=print)  # 轮询直到完成, 返回最终摘要
+    # >>> task.cancel()
+    """
+
+    def __init__(self, es, task_id: str, action: str = 'update_by_query', on_done=None):
+        """
+        action: 任务类型, 决定 rethrottle 使用的接口
+        on_done: 任务完成时的回调 on_done(summary), 只调用一次
+        """
+        if action not in RETHROTTLE:
+            raise Exception(f'ESTask need param(action) in {list(RETHROTTLE)}')
+        self.es = es
+        self.task_id = task_id
+        self.action = action
+        self.on_done = on_done
+        self.summary = None
+
+    def _finish(self, summary: dict) -> dict:
+        if summary['completed'] and self.summary is None:
+            self.summary = summary
+            callable(self.on_done) and self.on_done(summary)
+        return summary
+
+    def status(self) -> dict:
+        """ 当前进度 完成后为最终结果 """
+        if self.summary is not None:
+            return self.summary
+        return self._finish(summarize(self.task_id, self.es.tasks.get(task_id=self.task_id)))
+
+    @property
+    def done(self) -> bool:
+        return self.status()['completed']
+
+    def wait(self, poll: float = 5, timeout: float = None, progress=None) -> dict:
+        """
+        轮询直到任务完成 返回最终摘要; timeout 秒后仍未完成时返回当前进度(completed=False)
+        progress: 进度回调 progress(done, elapsed)
+        """
+        start = time.monotonic()
+        while True:
+            summary = self.status()
+            callable(progress) and progress(summary['done'], summary['seconds'])
+            if summary['completed']:
+                break
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return summary
+            time.sleep(poll)
+
+        logging.info(f'{self.action} task {self.task_id}: {summary["done"]}/{summary["total"]} docs, '
+                     f'{summary["docs_per_sec"]:.0f} docs/s, {len(summary["failures"])} failures')
+        return summary
+
+    def rethrottle(self, requests_per_second: float):
+        """ 调整运行中任务的速度 -1 为不限速 """
+        getattr(self.es, RETHROTTLE[self.action])(task_id=self.task_id, requests_per_second=requests_per_second)
+
+    def cancel(self):
+        """ 取消任务 已处理的数据不会回滚 """
+        self.es.tasks.cancel(task_id=self.task_id)
+
+    def __repr__(self):
+        return f'ESTask({self.action}, {self.task_id})'
+
+
+class AsyncESTask(ESTask):
+    """ AsyncElasticsearch 的任务句柄 方法同 ESTask, 均为协程 """
+
+    async def status(self) -> dict:
+        if self.summary is not None:
+            return self.summary
+        return self._finish(summarize(self.task_id, await self.es.tasks.get(task_id=self.task_id)))
+
+    @property
+    def done(self) -> bool:
+        return self.summary is not None
+
+    async def wait(self, poll: float = 5, timeout: float = None, progress=None) -> dict:
+        start = time.monotonic()
+        while True:
+            summary = await self.status()
+            callable(progress) and progress(summary['done'], summary['seconds'])
+            if summary['completed'] or (timeout is not None and time.monotonic() - start >= timeout):
+                return summary
+            await asyncio.sleep(poll)
+
+    async def rethrottle(self, requests_per_second: float):
+        await getattr(self.es, RETHROTTLE[self.action])(task_id=self.task_id, requests_per_second=requests_per_second)
+
+    async def cancel(self):
+        await self.es.tasks.cancel(task_id=self.task_id)
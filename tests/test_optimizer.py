@@ -0,0 +1,137 @@
+"""
+optimizer 等价性测试: 随机生成查询, 比较优化前后在同一批文档上的匹配结果
+usage:
+# python -m pytest -q tests/test_optimizer.py
+"""
+import json
+import random
+import unittest
+
+from sentence import Q
+from optimizer import optimize, is_scoring
+
+FIELDS = ['a', 'b', 'c']
+
+
+def _msm(body: dict, should: list) -> int:
+    """ 按 es 规则计算 minimum_should_match, 百分比向下取整 """
+    msm = body.get('minimum_should_match')
+    if msm is None:
+        return 0 if body.get('must') or body.get('filter') else 1
+    if isinstance(msm, str) and msm.endswith('%'):
+        return len(should) * int(msm[:-1]) // 100
+    return int(msm)
+
+
+def matches(query: dict, doc: dict) -> bool:
+    """ 在内存中求值 bool/term/terms/match/range/exists, 文档字段均为多值 list """
+    (kind, body), = query.items()
+    if kind == 'bool':
+        if not all(matches(c, doc) for c in body.get('must', []) + body.get('filter', [])):
+            return False
+        if any(matches(c, doc) for c in body.get('must_not', [])):
+            return False
+        should = body.get('should', [])
+        return not should or sum(matches(c, doc) for c in should) >= _msm(body, should)
+    if kind == 'exists':
+        return bool(doc[body['field']])
+    (field, value), = body.items()
+    if kind in ('term', 'match'):
+        return (value['value'] if isinstance(value, dict) else value) in doc[field]
+    if kind == 'terms':
+        return any(v in doc[field] for v in value)
+    if kind == 'range':
+        return any(v >= value['gte'] for v in doc[field])
+    raise Exception(f'unsupported query {kind}')
+
+
+class OptimizerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rdm = random.Random(1)
+        self.docs = [{f: self.rdm.sample(range(4), self.rdm.randint(0, 2)) for f in FIELDS} for _ in range(300)]
+
+    def leaf_query(self) -> dict:
+        field, value = self.rdm.choice(FIELDS), self.rdm.randint(0, 3)
+        return self.rdm.choice([
+            {'term': {field: value}},
+            {'terms': {field: [value, self.rdm.randint(0, 3)]}},
+            {'range': {field: {'gte': value}}},
+        ])
+
+    def raw_bool(self, depth: int = 0) -> dict:
+        body = dict()
+        for occ in ('must', 'filter', 'should', 'must_not'):
+            if self.rdm.random() < 0.5:
+                clauses = [self.raw_bool(depth + 1) if depth < 3 and self.rdm.random() < 0.4 else self.leaf_query()
+                           for _ in range(self.rdm.randint(1, 3))]
+                # 重复条件 覆盖去重
+                self.rdm.random() < 0.3 and clauses.append(clauses[0])
+                body[occ] = clauses
+        if 'should' in body and self.rdm.random() < 0.4:
+            body['minimum_should_match'] = self.rdm.choice([1, 2, '1', '50%', '100%'])
+        return {'bool': body}
+
+    def q_tree(self, depth: int = 0) -> Q:
+        def leaf():
+            field, value = self.rdm.choice(FIELDS), self.rdm.randint(0, 3)
+            occ = self.rdm.choice(['must', 'filter', 'should', 'must_not'])
+            kind = self.rdm.choice(['term', 'term', 'match', 'range', 'exists'])
+            if kind == 'range':
+                return Q.common(kind, occ, **{field: {'gte': value}})
+            if kind == 'exists':
+                return Q.common(kind, occ, field=field)
+            return Q.common(kind, occ, **{field: value})
+
+        q = leaf()
+        for _ in range(self.rdm.randint(0, 3)):
+            other = self.q_tree(depth + 1) if depth < 2 and self.rdm.random() < 0.4 else leaf()
+            q = (q | other) if self.rdm.random() < 0.4 else (q & other)
+        return q
+
+    def assert_equivalent(self, body: dict):
+        for variant in (body, {**body, 'sort': [{'age': 'desc'}]}, {**body, 'size': 0}):
+            optimized = optimize(variant)
+            expected = [matches(variant['query'], d) for d in self.docs]
+            actual = [matches(optimized['query'], d) for d in self.docs]
+            self.assertEqual(expected, actual, f'{json.dumps(variant)}\n{json.dumps(optimized)}')
+
+    def test_random_raw_bool(self):
+        for _ in range(400):
+            self.assert_equivalent({'query': self.raw_bool()})
+
+    def test_random_q_tree(self):
+        for _ in range(400):
+            self.assert_equivalent(self.q_tree()())
+
+    def test_duplicate_should_with_msm(self):
+        a, b = {'term': {'a': 1}}, {'term': {'b': 1}}
+        for msm in (2, '2', '50%', '100%'):
+            self.assert_equivalent({'query': {'bool': {'should': [a, a, b], 'minimum_should_match': msm}}})
+            body = optimize({'size': 0, 'query': {'bool': {'should': [a, a, b], 'minimum_should_match': msm}}})
+            self.assertEqual(len(body['query']['bool']['should']), 3)
+
+    def test_exact_scores_keep_must(self):
+        must = [{'range': {'a': {'gte': 1}}}, {'match': {'b': 1}}]
+        for extra in ({'min_score': 1.5}, {'aggs': {'top': {'top_hits': {'size': 1}}}},
+                      {'size': 0, 'aggs': {'g': {'terms': {'field': 'a'}, 'aggs': {'s': {'max': {'script': '_score'}}}}}}):
+            body = optimize({'query': {'bool': {'must': must}}, **extra})
+            self.assertEqual(body['query']['bool'], {'must': must}, extra)
+        self.assertEqual(optimize({'query': {'bool': {'must': must}}})['query']['bool'],
+                         {'must': must[1:], 'filter': must[:1]})
+
+    def test_is_scoring(self):
+        self.assertTrue(is_scoring({}))
+        self.assertFalse(is_scoring({'size': 0}))
+        self.assertFalse(is_scoring({'sort': [{'age': 'desc'}]}))
+        self.assertTrue(is_scoring({'sort': [{'age': 'desc'}], 'min_score': 0.5}))
+        self.assertTrue(is_scoring({'sort': [{'age': 'desc'}], 'track_scores': True}))
+        self.assertTrue(is_scoring({'size': 0, 'min_score': 1}))
+        self.assertTrue(is_scoring({'size': 0, 'aggs': {'top': {'top_hits': {}}}}))
+        self.assertTrue(is_scoring({'size': 0, 'aggs': {'g': {'terms': {'field': 'a'},
+                                                              'aggs': {'top': {'top_hits': {}}}}}}))
+        self.assertFalse(is_scoring({'size': 0, 'aggs': {'g': {'terms': {'field': 'a'}}}}))
+
+
+if __name__ == '__main__':
+    unittest.main()